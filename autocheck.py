@@ -1,12 +1,22 @@
 import argparse
+import base64
+import copy
+import gzip
+import hashlib
+import io
 import json
 import re
+import sqlite3
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from html import escape
 from html.parser import HTMLParser
-from urllib.parse import urljoin
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
 
 import os
+import random
 import requests
 
 # Selenium / pytz are imported lazily so that offline HTML parsing (used to
@@ -19,7 +29,11 @@ EC = None
 WebDriverWait = None
 NoSuchElementException = Exception
 TimeoutException = Exception
-driver = None
+WebDriverException = Exception
+driver_pool = None
+_gist_id_cache = None
+_state_checkpoint = None
+_http_session = None
 
 # Asia/Tokyo is a fixed +9 offset with no DST, so we avoid the pytz dependency.
 JST = timezone(timedelta(hours=9))
@@ -50,21 +64,122 @@ COLOR_SELECTORS = (
     ".product-attribute__color label",
 )
 
+LISTING_URL = BASE + "/shop/web-specials?start={start}&sz={sz}"
+# Salesforce Commerce Cloud serves the bare product grid fragment (the same
+# tiles the page renders) from its Search-UpdateGrid controller, so round 1 can
+# be crawled over plain HTTP. Override with LISTING_GRID_URL if the site ID
+# changes; "{start}" and "{sz}" are filled in per page.
+LISTING_GRID_URL = os.getenv("LISTING_GRID_URL") or (
+    BASE
+    + "/on/demandware.store/Sites-patagonia-jp-Site/ja_JP/Search-UpdateGrid"
+    + "?cgid=web-specials&start={start}&sz={sz}"
+)
+HTTP_POOL_SIZE = 8
+LISTING_CONCURRENCY = 4  # listing pages in flight at once on the HTTP path
+QUICKADD_WORKERS = 4  # quick-add payloads prefetched in parallel during round 2
+HTTP_RETRIES = 3  # extra attempts on 429/5xx/connection errors, with exponential backoff
+LISTING_PAGE_SIZE_PROBE = 1000  # first-run sz; the grid shrinks it to what it honors
+LISTING_PAGE_SIZE_RETRY = 48  # sz tried once when page 1 errors or has no tiles
+
+# Lean browser profile (see _new_driver). Set LEAN_BROWSER=0 (or false/no/off)
+# for a full one.
+LEAN_BROWSER = os.getenv("LEAN_BROWSER", "1").strip().lower() not in ("0", "false", "no", "off")
+LEAN_CHROME_ARGS = (
+    "--blink-settings=imagesEnabled=false",
+    "--disable-background-networking",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--disable-translate",
+    "--disable-features=Translate,MediaRouter,OptimizationHints,AutofillServerCommunication",
+    "--disable-component-update",
+    "--mute-audio",
+    "--no-first-run",
+)
+LEAN_CHROME_PREFS = {
+    "profile.managed_default_content_settings.images": 2,
+    "profile.managed_default_content_settings.media_stream": 2,
+    "profile.default_content_setting_values.notifications": 2,
+    "profile.default_content_setting_values.geolocation": 2,
+}
+LEAN_BLOCKED_URLS = (
+    "*.jpg", "*.jpeg", "*.png", "*.gif", "*.webp", "*.avif", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.mp4", "*.webm", "*.mp3", "*.m3u8",
+    "*googletagmanager.com*", "*google-analytics.com*", "*doubleclick.net*",
+    "*connect.facebook.net*", "*facebook.com/tr*", "*hotjar.com*", "*clarity.ms*",
+    "*criteo.com*", "*criteo.net*", "*analytics.tiktok.com*", "*bat.bing.com*",
+    "*yahoo.co.jp/*s.js*", "*zendesk.com*", "*zdassets.com*", "*livechatinc.com*",
+    "*karte.io*", "*optimizely.com*", "*quantummetric.com*",
+)
+
 PRODUCT_GIST_DESCRIPTION = "Patagonia Discounted Products"
 PRODUCT_GIST_FILE = "discounted_products.html"
+# Products per HTML page; with more, the list is split into
+# discounted_products.html, discounted_products_p2.html, ... (0: one page).
+PRODUCTS_PAGE_SIZE = int(os.getenv("PRODUCTS_PAGE_SIZE") or 0)
+# NDJSON feed of the published items (one JSON object per line), written as
+# round 2 finalizes them and published next to the HTML. "0" disables it.
+PUBLISH_FEED = os.getenv("PUBLISH_FEED", "1").strip().lower() not in ("0", "false", "no", "off")
+FEED_GIST_FILE = "discounted_products.ndjson"
+# Local copy of the feed while it is being written; "" keeps it in memory.
+FEED_PATH = os.getenv("FEED_PATH", os.path.join(".cache", FEED_GIST_FILE))
+# Width requested from the image CDN for product thumbnails.
+RENDER_IMAGE_WIDTH = int(os.getenv("RENDER_IMAGE_WIDTH") or 400)
 STATE_GIST_DESCRIPTION = "Patagonia Discount State"
 STATE_GIST_FILE = "discount_state.json"
-MAX_TELEGRAM_ITEMS = 8
+# State is stored as a gzip+base64 checkpoint plus one cumulative delta
+# against it (see _encode_state); set STATE_COMPACT=0 to write plain JSON.
+# Either format is read back.
+STATE_COMPACT = os.getenv("STATE_COMPACT", "1").strip().lower() not in ("0", "false", "no", "off")
+STATE_CHECKPOINT_FILE = "discount_state.checkpoint"
+# Rewrite the checkpoint once the delta grows past this share of its size.
+STATE_DELTA_MAX_RATIO = float(os.getenv("STATE_DELTA_MAX_RATIO") or 0.5)
+# Publish the state as a second file of the product gist, so the HTML and the
+# state go out in one multi-file PATCH and cannot drift apart. Off by default;
+# on first use the state is still read from the separate state gist.
+# Trade-off: the product gist is public and a gist cannot mix visibility, so in
+# this mode the state (snapshot, Telegram delivery record, product cache) is
+# public too. Leave it off if the state must stay in the private state gist.
+COMBINED_GIST = os.getenv("COMBINED_GIST", "").strip().lower() in ("1", "true", "yes", "on")
+# description -> gist id, so lookups skip the paginated /gists listing. Lives
+# next to the product cache (restored by actions/cache). "" disables the file.
+GIST_ID_CACHE_PATH = os.getenv("GIST_ID_CACHE_PATH", os.path.join(".cache", "gist_ids.json"))
+# Telegram rejects texts over 4096 characters; larger updates are split.
+TELEGRAM_MESSAGE_LIMIT = 3900
+# Token bucket for sends to one chat: TELEGRAM_BURST back to back, then
+# TELEGRAM_RATE per second. A 429's retry_after pauses the bucket.
+TELEGRAM_RATE = 1.0
+TELEGRAM_BURST = 3
+TELEGRAM_RETRIES = 3  # extra attempts on 429/5xx/connection errors
+# Opt-in (--stream-alerts): alert on additions while round 2 runs, in batches
+# collected for up to STREAM_ALERT_WINDOW seconds; the end-of-run message
+# then only carries what was not streamed, plus the list link.
+STREAM_ALERTS = os.getenv("STREAM_ALERTS", "").strip().lower() in ("1", "true", "yes", "on")
+STREAM_ALERT_WINDOW = float(os.getenv("STREAM_ALERT_WINDOW") or 20)
 TEST_STOP_AFTER_FILTERED_PRODUCTS = 0  # 0 means full run.
 TEST_REQUIRE_COLOR_PRICE_DATA = False  # True means test stops only after actual per-color price filtering.
+# Parallel headless Chrome instances for round 2 (product pages).
+ROUND2_WORKERS = int(os.getenv("ROUND2_WORKERS") or 0) or os.cpu_count() or 1
+# Reuse the previous run's color/size groups for products whose listing
+# signature is unchanged and whose groups are younger than this (0 disables).
+# Sizes only come from round 2, so a reused group hides restocks until it
+# expires: the default stays under the 6-hourly cron interval, so every
+# scheduled run rescrapes; lower it when checking more often (--watch).
+ROUND2_CACHE_TTL_HOURS = float(os.getenv("ROUND2_CACHE_TTL_HOURS") or 5)
+# On-disk SQLite copy of the round-2 results; point it at a directory kept by
+# actions/cache (or any local path) so it survives between runs. "" disables.
+PRODUCT_CACHE_PATH = os.getenv("PRODUCT_CACHE_PATH", os.path.join(".cache", "product_cache.sqlite3"))
+PRODUCT_CACHE_MAX_PRODUCTS = int(os.getenv("PRODUCT_CACHE_MAX_PRODUCTS") or 5000)
 
 def _ensure_selenium():
     """Import selenium on demand and expose the symbols used by the online flow."""
     global webdriver, By, EC, WebDriverWait, NoSuchElementException, TimeoutException
+    global WebDriverException
     from selenium import webdriver as _webdriver
     from selenium.common.exceptions import (
         NoSuchElementException as _NoSuchElementException,
         TimeoutException as _TimeoutException,
+        WebDriverException as _WebDriverException,
     )
     from selenium.webdriver.common.by import By as _By
     from selenium.webdriver.support import expected_conditions as _EC
@@ -76,13 +191,19 @@ def _ensure_selenium():
     WebDriverWait = _WebDriverWait
     NoSuchElementException = _NoSuchElementException
     TimeoutException = _TimeoutException
+    WebDriverException = _WebDriverException
+
 
+def _new_driver(lean=None):
+    """Launch a new headless Chrome driver.
 
-def _get_driver():
-    """Create (once) and return the headless Chrome driver."""
-    global driver
-    if driver is not None:
-        return driver
+    In lean mode (LEAN_BROWSER, on by default) images, fonts, media and known
+    tracker/chat hosts are blocked and the page load returns at
+    DOMContentLoaded; the data-pid tiles and color/size options we read are
+    server-rendered markup, so they still show up.
+    """
+    if lean is None:
+        lean = LEAN_BROWSER
     _ensure_selenium()
     options = webdriver.ChromeOptions()
     options.add_argument("--headless=new")  # 无头模式，后台运行
@@ -92,8 +213,122 @@ def _get_driver():
     options.add_argument("disable-infobars")
     options.add_argument("--disable-extensions")
     options.add_argument(f"user-agent={DEFAULT_USER_AGENT}")
-    driver = webdriver.Chrome(options=options)
-    return driver
+    if lean:
+        options.page_load_strategy = "eager"
+        for arg in LEAN_CHROME_ARGS:
+            options.add_argument(arg)
+        options.add_experimental_option("prefs", LEAN_CHROME_PREFS)
+    drv = webdriver.Chrome(options=options)
+    if lean:
+        try:
+            drv.execute_cdp_cmd("Network.enable", {})
+            drv.execute_cdp_cmd("Network.setBlockedURLs", {"urls": list(LEAN_BLOCKED_URLS)})
+        except Exception as exc:
+            print(f"[driver] could not set blocked URLs: {exc}")
+    return drv
+
+
+class _DriverPool:
+    """Warm headless Chrome instances shared by the scraping threads.
+
+    Round-2 workers acquire() a driver per product page and release() it
+    afterwards, so instances are reused across items and, in --watch mode,
+    across checks; a worker whose browser crashed discard()s it instead and
+    the next acquire() launches a fresh one. The listing fallback does the
+    same around each page it loads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = []
+        self._drivers = []
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        drv = _new_driver()
+        with self._lock:
+            self._drivers.append(drv)
+        return drv
+
+    def release(self, drv):
+        with self._lock:
+            if drv in self._drivers:
+                self._idle.append(drv)
+
+    def discard(self, drv):
+        with self._lock:
+            if drv in self._drivers:
+                self._drivers.remove(drv)
+            if drv in self._idle:
+                self._idle.remove(drv)
+        try:
+            drv.quit()
+        except Exception:
+            pass
+
+    def quit_all(self):
+        with self._lock:
+            drivers, self._drivers, self._idle = self._drivers, [], []
+        for drv in drivers:
+            try:
+                drv.quit()
+            except Exception:
+                pass
+
+
+def _get_driver_pool():
+    global driver_pool
+    if driver_pool is None:
+        driver_pool = _DriverPool()
+    return driver_pool
+
+
+def _get_http_session():
+    """Create (once) and return the shared keep-alive HTTP session."""
+    global _http_session
+    if _http_session is not None:
+        return _http_session
+    session = requests.Session()
+    session.headers.update({
+        "User-Agent": DEFAULT_USER_AGENT,
+        "Accept-Language": "ja,en;q=0.8",
+        "Accept-Encoding": "gzip, deflate",
+    })
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    _http_session = session
+    return _http_session
+
+
+def _http_get(url, headers=None, timeout=20, retries=HTTP_RETRIES, backoff=1.0, label="http"):
+    """GET through the shared session, retrying 429/5xx with exponential backoff.
+
+    Returns the final response (which may still be an error status), or None
+    if every attempt failed to connect.
+    """
+    response = None
+    for attempt in range(retries + 1):
+        try:
+            response = _get_http_session().get(url, headers=headers, timeout=timeout)
+        except Exception as exc:
+            print(f"[{label}] error fetching {url}: {exc}")
+            response = None
+        else:
+            if response.status_code != 429 and response.status_code < 500:
+                return response
+        if attempt == retries:
+            break
+        delay = backoff * (2 ** attempt)
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        status = response.status_code if response is not None else "error"
+        print(f"[{label}] {status} for {url}, retrying in {delay:.1f}s")
+        time.sleep(delay)
+    return response
 
 
 def _num(s):
@@ -150,11 +385,15 @@ def _extract_size_text(element):
 
 
 def _collect_sizes_from_current_page(driver):
+    return _collect_sizes(lambda selector: driver.find_elements(By.CSS_SELECTOR, selector))
+
+
+def _collect_sizes(find_elements):
     seen = set()
     sizes = []
     for selector in SIZE_SELECTORS:
         try:
-            elements = driver.find_elements(By.CSS_SELECTOR, selector)
+            elements = find_elements(selector)
         except Exception:
             continue
         for el in elements:
@@ -194,16 +433,19 @@ def _parse_size_list(value):
     return [p for p in parts if p]
 
 
+COLOR_NAME_ATTRS = (
+    "data-display-value",
+    "data-color-name",
+    "data-value",
+    "data-attr-value",
+    "aria-label",
+    "title",
+)
+
+
 def _extract_color_name(element, fallback):
-    candidates = (
-        element.get_attribute("data-display-value"),
-        element.get_attribute("data-color-name"),
-        element.get_attribute("data-value"),
-        element.get_attribute("data-attr-value"),
-        element.get_attribute("aria-label"),
-        element.get_attribute("title"),
-        element.text,
-    )
+    candidates = [element.get_attribute(attr) for attr in COLOR_NAME_ATTRS]
+    candidates.append(element.text)
     for cand in candidates:
         if not cand:
             continue
@@ -290,9 +532,13 @@ def _extract_color_prices(element, data_el):
 
 
 def _find_color_elements(driver):
-    for selector in COLOR_SELECTORS:
+    return _find_first(lambda selector: driver.find_elements(By.CSS_SELECTOR, selector), COLOR_SELECTORS)
+
+
+def _find_first(find_elements, selectors):
+    for selector in selectors:
         try:
-            elements = driver.find_elements(By.CSS_SELECTOR, selector)
+            elements = find_elements(selector)
         except Exception:
             elements = []
         if elements:
@@ -335,21 +581,291 @@ def _is_selected_color_option(element, data_el):
     return False
 
 
-def _wait_for_color_selection(driver, color_name, timeout=3.0):
-    deadline = time.time() + timeout
-    while time.time() < deadline:
-        for element in _find_color_elements(driver):
-            try:
-                data_el = _get_color_data_element(element)
-                current_name = _extract_color_name(data_el, fallback="")
-                if _colors_match(current_name, color_name) and _is_selected_color_option(element, data_el):
-                    return True
-            except Exception:
-                continue
-        time.sleep(0.1)
+# Mirrors _is_selected_color_option in the page; isOptionSelected(el) checks a color
+# option and its data element (see _get_color_data_element).
+_IS_SELECTED_JS = """
+function low(el, name) { return (el.getAttribute(name) || '').toLowerCase(); }
+function cls(el) {
+    var c = el.getAttribute('class') || '';
+    return c.toLowerCase();
+}
+function isSelected(el) {
+    var c = cls(el);
+    if (['selected', 'active', 'current', 'checked'].some(function (f) { return c.indexOf(f) !== -1; })) { return true; }
+    if (['true', '1'].indexOf(low(el, 'aria-pressed')) !== -1) { return true; }
+    if (['true', '1'].indexOf(low(el, 'aria-checked')) !== -1) { return true; }
+    if (['true', 'page', 'step', 'location'].indexOf(low(el, 'aria-current')) !== -1) { return true; }
+    if (['true', '1'].indexOf(low(el, 'data-selected')) !== -1) { return true; }
+    return el.hasAttribute('checked') || el.checked === true;
+}
+function isOptionSelected(el) {
+    var dataEl = el.tagName.toLowerCase() === 'button' ? el : (el.querySelector('button') || el);
+    return isSelected(dataEl) || isSelected(el);
+}
+"""
+
+# Resolves once the page has reacted to a color click, or with false at
+# timeoutMs. With waitForPrice (the caller reads the price next) it resolves
+# with "price" as soon as the price nodes' content differs from before the
+# click, or with "selected" once the clicked option shows as selected and
+# mutations have been quiet for priceQuietMs -- a color priced like the
+# previous one never changes the price, and a pending Product-Variation
+# response usually keeps a loading state in the DOM until it lands. Without
+# it, it resolves as soon as a price node changes, or after mutations have
+# been quiet for settleMs. The observer is attached before the click so a
+# fast (synchronous) update cannot be missed.
+_CLICK_AND_WAIT_SCRIPT = """
+var el = arguments[0], priceSelector = arguments[1], settleMs = arguments[2],
+    timeoutMs = arguments[3], waitForPrice = arguments[4], priceQuietMs = arguments[5],
+    done = arguments[arguments.length - 1];
+var finished = false, settleTimer = null, observer = null;
+""" + _IS_SELECTED_JS + """
+function priceSnapshot() {
+    var nodes = document.querySelectorAll(priceSelector), parts = [];
+    for (var i = 0; i < nodes.length; i++) { parts.push(nodes[i].outerHTML); }
+    return parts.join("\\n");
+}
+var priceBefore = waitForPrice ? priceSnapshot() : null;
+function finish(result) {
+    if (finished) { return; }
+    finished = true;
+    if (observer) { observer.disconnect(); }
+    clearTimeout(settleTimer);
+    done(result);
+}
+function waitForQuietSelection() {
+    clearTimeout(settleTimer);
+    settleTimer = setTimeout(function () {
+        if (isOptionSelected(el)) { finish("selected"); }
+    }, priceQuietMs);
+}
+observer = new MutationObserver(function (mutations) {
+    if (waitForPrice) {
+        if (priceSnapshot() !== priceBefore) { finish("price"); return; }
+        waitForQuietSelection();
+        return;
+    }
+    for (var i = 0; i < mutations.length; i++) {
+        var node = mutations[i].target;
+        if (node.nodeType !== 1) { node = node.parentElement; }
+        if (node && node.closest && node.closest(priceSelector)) { finish("price"); return; }
+    }
+    clearTimeout(settleTimer);
+    settleTimer = setTimeout(function () { finish("settled"); }, settleMs);
+});
+observer.observe(document.body, {attributes: true, childList: true, subtree: true, characterData: true});
+setTimeout(function () { finish(false); }, timeoutMs);
+try { el.scrollIntoView({block: 'center'}); } catch (e) {}
+el.click();
+if (waitForPrice) { waitForQuietSelection(); }
+"""
+
+# Resolves true on the next DOM mutation, or false after timeoutMs.
+_NEXT_MUTATION_SCRIPT = """
+var timeoutMs = arguments[0], done = arguments[arguments.length - 1];
+var finished = false;
+function finish(result) {
+    if (finished) { return; }
+    finished = true;
+    observer.disconnect();
+    done(result);
+}
+var observer = new MutationObserver(function () { finish(true); });
+observer.observe(document.body, {attributes: true, childList: true, subtree: true, characterData: true});
+setTimeout(function () { finish(false); }, timeoutMs);
+"""
+
+COLOR_CLICK_SETTLE = 0.15  # seconds without mutations that count as "done"
+# Quiet time after which a selected option counts as done when the price is read
+# next and did not change (same price as the previous color).
+COLOR_CLICK_PRICE_QUIET = 0.5  # still under the fixed 0.7s sleep this replaced
+COLOR_CLICK_TIMEOUT = 3.0
+COLOR_CLICK_MIN_INTERVAL = 0.2  # politeness floor between clicks (each may fire an XHR)
+LEGACY_COLOR_CLICK_SLEEP = 0.7  # the fixed sleep the event-driven wait replaced
+
+
+class _Throttle:
+    """Minimum interval between actions; only sleeps for what is left of it."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.last = None
+
+    def wait(self):
+        if self.last is not None:
+            remaining = self.last + self.interval - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+        self.last = time.monotonic()
+
+
+# Per-product wait accounting for the round-2 timing report. Each worker
+# thread tracks its current product; finished products are folded into the
+# run totals under the lock.
+_wait_local = threading.local()
+_wait_totals_lock = threading.Lock()
+_wait_totals = {"products": 0, "clicks": 0, "waited": 0.0, "load": 0.0, "bytes": 0}
+
+
+def _wait_stats():
+    stats = getattr(_wait_local, "stats", None)
+    if stats is None:
+        stats = _wait_local.stats = {
+            "clicks": 0,
+            "waited": 0.0,
+            "load": 0.0,
+            "bytes": 0,
+            "throttle": _Throttle(COLOR_CLICK_MIN_INTERVAL),
+        }
+    return stats
+
+
+# Bytes come from the Resource Timing API; cross-origin responses without
+# Timing-Allow-Origin report 0, so this is a lower bound, but it is the same
+# lower bound with and without the lean profile.
+_PAGE_WEIGHT_SCRIPT = """
+var entries = performance.getEntriesByType('navigation').concat(performance.getEntriesByType('resource'));
+var bytes = 0;
+for (var i = 0; i < entries.length; i++) { bytes += entries[i].transferSize || 0; }
+return JSON.stringify({bytes: bytes, requests: entries.length});
+"""
+
+
+def _page_weight(driver):
+    try:
+        return json.loads(driver.execute_script(_PAGE_WEIGHT_SCRIPT))
+    except Exception:
+        return {"bytes": 0, "requests": 0}
+
+
+def _record_page_load(driver, started):
+    stats = _wait_stats()
+    stats["load"] = time.monotonic() - started
+    stats["bytes"] = _page_weight(driver)["bytes"]
+
+
+def _reset_wait_stats():
+    _wait_local.stats = None
+    return _wait_stats()
+
+
+def _finish_wait_stats(label):
+    stats = _wait_stats()
+    legacy = stats["clicks"] * LEGACY_COLOR_CLICK_SLEEP
+    print(
+        f"[timing] {label}: load {stats['load']:.2f}s, {stats['bytes'] / 1024:.0f} KiB;"
+        f" {stats['clicks']} color click(s), waited {stats['waited']:.2f}s"
+        f" (estimated fixed sleeps before: {stats['clicks']} x {LEGACY_COLOR_CLICK_SLEEP}s"
+        f" = {legacy:.2f}s)"
+    )
+    with _wait_totals_lock:
+        _wait_totals["products"] += 1
+        _wait_totals["clicks"] += stats["clicks"]
+        _wait_totals["waited"] += stats["waited"]
+        _wait_totals["load"] += stats["load"]
+        _wait_totals["bytes"] += stats["bytes"]
+
+
+def _report_wait_totals():
+    with _wait_totals_lock:
+        products = _wait_totals["products"]
+        clicks = _wait_totals["clicks"]
+        waited = _wait_totals["waited"]
+        load = _wait_totals["load"]
+        weight = _wait_totals["bytes"]
+        for key in _wait_totals:
+            _wait_totals[key] = 0
+    if not products:
+        return
+    legacy = clicks * LEGACY_COLOR_CLICK_SLEEP
+    print(
+        f"[timing] round 2: {clicks} color click(s) over {products} product page(s);"
+        f" waits {waited:.2f}s ({waited / products:.2f}s/product),"
+        f" estimated fixed sleeps before (clicks x {LEGACY_COLOR_CLICK_SLEEP}s):"
+        f" {legacy:.2f}s ({legacy / products:.2f}s/product)"
+    )
+    print(
+        f"[timing] round 2 page loads ({'lean' if LEAN_BROWSER else 'full'} profile):"
+        f" {load / products:.2f}s and {weight / products / 1024:.0f} KiB per product page"
+    )
+
+
+def _wait_for_next_mutation(driver, timeout):
+    try:
+        return bool(driver.execute_async_script(_NEXT_MUTATION_SCRIPT, int(timeout * 1000)))
+    except Exception:
+        time.sleep(min(timeout, 0.1))
+        return False
+
+
+# Mirrors _find_color_elements / _get_color_data_element / _extract_color_name /
+# _is_selected_color_option in the page, so each option's name and selected
+# state come back as one JSON string from a single execute_script instead of
+# dozens of WebDriver round trips per poll.
+_COLOR_STATE_SCRIPT = """
+var selectors = arguments[0], nameAttrs = arguments[1];
+""" + _IS_SELECTED_JS + """
+var elements = [];
+for (var i = 0; i < selectors.length; i++) {
+    try { elements = document.querySelectorAll(selectors[i]); } catch (e) { elements = []; }
+    if (elements.length) { break; }
+}
+return JSON.stringify(Array.prototype.map.call(elements, function (el) {
+    var dataEl = el.tagName.toLowerCase() === 'button' ? el : (el.querySelector('button') || el);
+    var name = '';
+    for (var j = 0; j < nameAttrs.length && !name; j++) {
+        name = (dataEl.getAttribute(nameAttrs[j]) || '').trim();
+    }
+    if (!name) { name = (dataEl.innerText || '').trim(); }
+    return {name: name, selected: isOptionSelected(el)};
+}));
+"""
+
+
+def _color_state_snapshot(driver):
+    """Return ``[{name, selected}, ...]`` for the color options, or None."""
+    try:
+        state = json.loads(
+            driver.execute_script(_COLOR_STATE_SCRIPT, list(COLOR_SELECTORS), list(COLOR_NAME_ATTRS))
+        )
+    except Exception as exc:
+        print(f"[color state] snapshot failed, using element queries: {exc}")
+        return None
+    return state if isinstance(state, list) else None
+
+
+def _is_color_selected(driver, color_name):
+    snapshot = _color_state_snapshot(driver)
+    if snapshot is not None:
+        return any(
+            entry.get("selected") and _colors_match(entry.get("name"), color_name)
+            for entry in snapshot
+        )
+    for element in _find_color_elements(driver):
+        try:
+            data_el = _get_color_data_element(element)
+            current_name = _extract_color_name(data_el, fallback="")
+            if _colors_match(current_name, color_name) and _is_selected_color_option(element, data_el):
+                return True
+        except Exception:
+            continue
     return False
 
 
+def _wait_for_color_selection(driver, color_name, timeout=3.0):
+    started = time.monotonic()
+    deadline = started + timeout
+    while True:
+        confirmed = _is_color_selected(driver, color_name)
+        remaining = deadline - time.monotonic()
+        if confirmed or remaining <= 0:
+            break
+        # 不再固定轮询：等到下一次 DOM 变化（或超时）再检查。
+        _wait_for_next_mutation(driver, min(remaining, 1.0))
+    _wait_stats()["waited"] += time.monotonic() - started
+    return confirmed
+
+
 def _extract_price_pair_from_text(text):
     if not text:
         return None, None
@@ -385,13 +901,35 @@ def _extract_current_page_prices(driver):
     return None, None
 
 
-def _click_color_element(driver, element):
+def _click_color_element(driver, element, wait_for_price=False):
+    """Click a color option and wait for the page to react.
+
+    Pass ``wait_for_price`` when the price is read right after the click: the
+    wait then lasts until the price nodes change, or until the clicked option
+    is selected and the page has been quiet for COLOR_CLICK_PRICE_QUIET (at
+    most COLOR_CLICK_TIMEOUT), instead of ending after COLOR_CLICK_SETTLE of
+    quiet. Returns the script's result: "price", "selected", "settled", or
+    False on timeout.
+    """
+    stats = _wait_stats()
+    stats["throttle"].wait()
+    started = time.monotonic()
+    outcome = False
     try:
-        driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", element)
-    except Exception:
+        outcome = driver.execute_async_script(
+            _CLICK_AND_WAIT_SCRIPT,
+            element,
+            ", ".join(PRICE_SELECTORS),
+            int(COLOR_CLICK_SETTLE * 1000),
+            int(COLOR_CLICK_TIMEOUT * 1000),
+            bool(wait_for_price),
+            int(COLOR_CLICK_PRICE_QUIET * 1000),
+        )
+    except TimeoutException:
         pass
-    driver.execute_script("arguments[0].click();", element)
-    time.sleep(0.7)
+    stats["clicks"] += 1
+    stats["waited"] += time.monotonic() - started
+    return outcome
 
 
 def _enrich_color_prices_by_click(driver, color_entries):
@@ -401,9 +939,12 @@ def _enrich_color_prices_by_click(driver, color_entries):
             continue
         color_name = result.get("color")
         try:
-            _click_color_element(driver, entry["element"])
-            if not _wait_for_color_selection(driver, color_name):
-                print(f"[color price click] selection did not confirm for {color_name}")
+            # The click wait also covers the selection (no second wait here).
+            if not _click_color_element(driver, entry["element"], wait_for_price=True):
+                print(
+                    f"[color price click] neither the price nor the selection changed"
+                    f" within {COLOR_CLICK_TIMEOUT}s after clicking {color_name}"
+                )
             sale_price, list_price = _extract_current_page_prices(driver)
             result["sale_price"] = sale_price
             result["list_price"] = list_price
@@ -415,15 +956,18 @@ def _enrich_color_prices_by_click(driver, color_entries):
             print(f"[color price click] error on {color_name}: {exc}")
 
 
-def _collect_sizes_by_color(driver):
-    elements = _find_color_elements(driver)
+def _collect_color_groups_from_attrs(elements, get_data_element):
+    """Read per-color sizes/prices from the color options' data attributes.
 
+    Returns ``(results, entries)``; ``entries`` pair each result with its
+    element so missing prices can be filled in by clicking it.
+    """
     attr_results = []
     attr_entries = []
     seen_keys = set()
 
     for idx, element in enumerate(elements, start=1):
-        data_el = _get_color_data_element(element)
+        data_el = get_data_element(element)
         color_name = f"Color #{idx}"
         try:
             if _is_disabled(element) and _is_disabled(data_el):
@@ -460,28 +1004,133 @@ def _collect_sizes_by_color(driver):
         except Exception as exc:
             print(f"[color sizes attr] error on {color_name}: {exc}")
 
+    return attr_results, attr_entries
+
+
+# Attributes the color-option logic reads via get_attribute; fetched in bulk.
+_COLOR_OPTION_ATTRS = tuple(dict.fromkeys(
+    ("class", "aria-disabled", "data-available", "disabled")
+    + COLOR_NAME_ATTRS
+    + ("data-attr-value", "data-caption", "data-size-stock", "data-online-instock")
+    + COLOR_SALE_PRICE_ATTRS
+    + COLOR_LIST_PRICE_ATTRS
+))
+
+# Finds the color options like _find_color_elements and returns, in one
+# execute_script, the elements themselves (for clicking) plus a JSON payload
+# of every option's (and its data element's) tag, text and requested
+# attributes. Boolean attributes follow WebElement.get_attribute: "true"/null.
+_COLOR_OPTIONS_SCRIPT = """
+var selectors = arguments[0], attrNames = arguments[1];
+var booleans = {disabled: true, checked: true, selected: true};
+function describe(el) {
+    var attrs = {};
+    attrNames.forEach(function (name) {
+        if (booleans[name]) {
+            attrs[name] = (el.hasAttribute(name) || el[name] === true) ? 'true' : null;
+        } else {
+            attrs[name] = el.getAttribute(name);
+        }
+    });
+    return {tag: el.tagName.toLowerCase(), text: (el.innerText || '').trim(), attrs: attrs};
+}
+var elements = [];
+for (var i = 0; i < selectors.length; i++) {
+    try { elements = Array.prototype.slice.call(document.querySelectorAll(selectors[i])); } catch (e) { elements = []; }
+    if (elements.length) { break; }
+}
+return {
+    elements: elements,
+    payload: JSON.stringify(elements.map(function (el) {
+        var dataEl = el.tagName.toLowerCase() === 'button' ? el : (el.querySelector('button') || el);
+        var option = describe(el);
+        option.data = dataEl === el ? null : describe(dataEl);
+        return option;
+    }))
+};
+"""
+
+
+class _PayloadElement:
+    """WebElement stand-in over one option of the _COLOR_OPTIONS_SCRIPT payload."""
+
+    __slots__ = ("tag_name", "text", "attrs", "data", "web_element")
+
+    def __init__(self, option, web_element=None):
+        self.tag_name = option.get("tag") or ""
+        self.text = option.get("text") or ""
+        self.attrs = option.get("attrs") or {}
+        self.web_element = web_element
+        data = option.get("data")
+        self.data = _PayloadElement(data, web_element) if data else self
+
+    def get_attribute(self, name):
+        return self.attrs.get(name)
+
+
+def _payload_data_element(option):
+    """_get_color_data_element for _PayloadElement options (resolved in the page)."""
+    return option.data
+
+
+def _bulk_color_options(driver):
+    """Return ``[(option, element), ...]`` for the color options, or None.
+
+    ``option`` answers get_attribute/text from the bulk payload and ``element``
+    is the live WebElement, used only when a color has to be clicked.
+    """
+    try:
+        result = driver.execute_script(
+            _COLOR_OPTIONS_SCRIPT, list(COLOR_SELECTORS), list(_COLOR_OPTION_ATTRS)
+        )
+        elements = result.get("elements") or []
+        payload = json.loads(result.get("payload") or "[]")
+    except Exception as exc:
+        print(f"[color sizes attr] bulk extraction failed, using element queries: {exc}")
+        return None
+    if len(payload) != len(elements):
+        return None
+    return [
+        (_PayloadElement(option, element), element)
+        for option, element in zip(payload, elements)
+    ]
+
+
+def _collect_sizes_by_color(driver):
+    options = _bulk_color_options(driver)
+    if options is None:
+        options = [(element, element) for element in _find_color_elements(driver)]
+        get_data_element = _get_color_data_element
+    else:
+        get_data_element = _payload_data_element
+    attr_results, attr_entries = _collect_color_groups_from_attrs(
+        [option for option, _ in options], get_data_element
+    )
+
     if attr_results:
         if any(not r.get("sale_price") or not r.get("list_price") for r in attr_results):
+            for entry in attr_entries:
+                entry["element"] = getattr(entry["element"], "web_element", None) or entry["element"]
             _enrich_color_prices_by_click(driver, attr_entries)
         return attr_results
 
     # 兜底：退回旧的点击方式
     click_results = []
-    seen_keys.clear()
+    seen_keys = set()
 
-    if not elements:
+    if not options:
         sizes = _collect_sizes_from_current_page(driver)
         if sizes:
             click_results.append({"color": None, "sizes": sizes})
         return click_results
 
-    for idx, element in enumerate(elements, start=1):
+    for idx, (option, element) in enumerate(options, start=1):
         color_name = f"Color #{idx}"
         try:
-            if _is_disabled(element):
+            if _is_disabled(option):
                 continue
-            color_name = _extract_color_name(element, fallback=color_name)
-            color_key = element.get_attribute("data-attr-value") or color_name
+            color_name = _extract_color_name(option, fallback=color_name)
+            color_key = option.get_attribute("data-attr-value") or color_name
             if color_key in seen_keys:
                 continue
 
@@ -547,56 +1196,81 @@ def _parse_sizes_from_html(html):
 def _fetch_sizes_from_quick_add(qa_url):
     if not qa_url:
         return []
+    response = _http_get(
+        qa_url,
+        headers={"X-Requested-With": "XMLHttpRequest"},
+        timeout=15,
+        label="sizes quickadd",
+    )
+    if response is None:
+        return []
+    if response.status_code != 200:
+        print(f"[sizes quickadd] status {response.status_code} for {qa_url}")
+        return []
     try:
-        response = requests.get(
-            qa_url,
-            headers={
-                "User-Agent": DEFAULT_USER_AGENT,
-                "X-Requested-With": "XMLHttpRequest",
-            },
-            timeout=15,
-        )
-        if response.status_code != 200:
-            print(f"[sizes quickadd] status {response.status_code} for {qa_url}")
-            return []
         return _parse_sizes_from_html(response.text)
     except Exception as exc:
-        print(f"[sizes quickadd] error fetching {qa_url}: {exc}")
+        print(f"[sizes quickadd] error parsing {qa_url}: {exc}")
         return []
 
 
-def _fetch_sizes_from_product_page(product_url, main_window):
+def _fetch_sizes_from_product_page(drv, product_url):
     if not product_url:
         return []
+    print(f"[sizes product] open {product_url}")
+    _reset_wait_stats()
+    started = time.monotonic()
+    drv.get(product_url)
     try:
-        driver.execute_script("window.open(arguments[0], '_blank');", product_url)
-        print(f"[sizes product] open {product_url}")
-    except Exception as exc:
-        print(f"[sizes product] failed to open tab for {product_url}: {exc}")
-        return []
+        WebDriverWait(drv, 15, poll_frequency=0.1).until(
+            EC.presence_of_element_located((By.CSS_SELECTOR, "[data-attr='color'], fieldset[data-attr='size']"))
+        )
+    except TimeoutException:
+        print(f"[sizes product] timeout waiting for options on {product_url}")
+    _record_page_load(drv, started)
+    color_sizes = parse_product_html(drv.page_source)
+    if _product_groups_complete(color_sizes):
+        _finish_wait_stats(product_url)
+        print(f"[sizes product] parsed {len(color_sizes)} color groups from HTML for {product_url}")
+        return color_sizes
+    color_sizes = _collect_sizes_by_color(drv)
+    _finish_wait_stats(product_url)
+    print(f"[sizes product] collected {len(color_sizes)} color groups for {product_url}")
+    return color_sizes
 
-    color_sizes = []
-    try:
-        driver.switch_to.window(driver.window_handles[-1])
-        try:
-            WebDriverWait(driver, 15).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "[data-attr='color'], fieldset[data-attr='size']"))
-            )
-        except TimeoutException:
-            print(f"[sizes product] timeout waiting for options on {product_url}")
-        color_sizes = _collect_sizes_by_color(driver)
-        print(f"[sizes product] collected {len(color_sizes)} color groups for {product_url}")
-    finally:
-        try:
-            driver.close()
-        except Exception:
-            pass
+
+def _scrape_product_page(pool, product_url):
+    """Round-2 worker task: scrape one product page on a pooled driver.
+
+    A browser-level failure (crashed tab, dead session, or a browser that
+    fails to launch) discards only that driver and retries once on a fresh
+    one; the item then falls back to quick-add sizes like any other page
+    without color data.
+    """
+    for attempt in (1, 2):
+        drv = None
         try:
-            driver.switch_to.window(main_window)
-        except Exception:
-            # 如果句柄顺序变化则退回第一个句柄
-            driver.switch_to.window(driver.window_handles[0])
-    return color_sizes
+            drv = pool.acquire()
+            color_sizes = _fetch_sizes_from_product_page(drv, product_url)
+        except TimeoutException as exc:
+            pool.release(drv)
+            print(f"[sizes product] page load timeout for {product_url}: {exc}")
+            return []
+        except WebDriverException as exc:
+            if drv is not None:
+                pool.discard(drv)
+            print(f"[sizes product] driver failed on {product_url} (attempt {attempt}): {exc}")
+            continue
+        except Exception as exc:
+            if drv is None:
+                print(f"[sizes product] could not start a driver for {product_url}: {exc}")
+                return []
+            pool.release(drv)
+            print(f"[sizes product] error on {product_url}: {exc}")
+            return []
+        pool.release(drv)
+        return color_sizes
+    return []
 
 
 def _build_github_headers():
@@ -609,39 +1283,154 @@ def _build_github_headers():
     }
 
 
+def _gist_ids():
+    """Return the description -> gist id map, read from GIST_ID_CACHE_PATH once."""
+    global _gist_id_cache
+    if _gist_id_cache is None:
+        _gist_id_cache = {}
+        if GIST_ID_CACHE_PATH:
+            try:
+                with open(GIST_ID_CACHE_PATH, encoding="utf-8") as fp:
+                    data = json.load(fp)
+                if isinstance(data, dict):
+                    _gist_id_cache.update(
+                        (str(key), str(value)) for key, value in data.items() if value
+                    )
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as exc:
+                print(f"[gist] ignoring id cache {GIST_ID_CACHE_PATH}: {exc}")
+    return _gist_id_cache
+
+
+def _remember_gist_id(description, gist_id):
+    """Record (or with ``gist_id=None`` forget) a resolved id and persist the map."""
+    ids = _gist_ids()
+    if gist_id is None:
+        if ids.pop(description, None) is None:
+            return
+    elif ids.get(description) == gist_id:
+        return
+    else:
+        ids[description] = gist_id
+    if not GIST_ID_CACHE_PATH:
+        return
+    try:
+        directory = os.path.dirname(GIST_ID_CACHE_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = GIST_ID_CACHE_PATH + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fp:
+            json.dump(ids, fp, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(tmp_path, GIST_ID_CACHE_PATH)
+    except OSError as exc:
+        print(f"[gist] failed to write id cache {GIST_ID_CACHE_PATH}: {exc}")
+
+
+def _list_gists_for(description, headers):
+    """Page through /gists (following ``Link: rel="next"``) until ``description`` turns up.
+
+    Returns the listing entry (file contents are not included there) or None.
+    """
+    url = "https://api.github.com/gists?per_page=100"
+    pages = 0
+    try:
+        while url:
+            response = requests.get(url, headers=headers, timeout=30)
+            if response.status_code != 200:
+                print(f"[gist] failed to list gists: {response.status_code} {response.text}")
+                return None
+            pages += 1
+            for gist in response.json():
+                if gist.get("description") == description:
+                    _remember_gist_id(description, gist["id"])
+                    return gist
+            url = (response.links.get("next") or {}).get("url")
+    except Exception as exc:
+        print(f"[gist] list error: {exc}")
+        return None
+    print(f"[gist] no gist named {description!r} in {pages} listing page(s)")
+    return None
+
+
+def _existing_gist(description, headers):
+    """Return the gist titled ``description`` (id and file names at least), or None.
+
+    A cached id is checked with a GET first: if it is gone or now carries another
+    description it is dropped and the gist is looked up again by listing. The
+    GET result carries file contents, a listing entry does not.
+    """
+    gist_id = _gist_ids().get(description)
+    if gist_id:
+        response = requests.get(f"https://api.github.com/gists/{gist_id}", headers=headers, timeout=30)
+        if response.status_code not in (200, 404):
+            raise RuntimeError(f"failed to fetch gist {gist_id}: {response.status_code} {response.text}")
+        gist = response.json() if response.status_code == 200 else None
+        if gist and gist.get("description") == description:
+            return gist
+        print(f"[gist] cached id {gist_id} for {description!r} is stale, looking it up again")
+        _remember_gist_id(description, None)
+    return _list_gists_for(description, headers)
+
+
 def _find_gist_by_description(description, headers):
+    """Fetch the full gist (with file contents) titled ``description``."""
     try:
-        response = requests.get("https://api.github.com/gists", headers=headers, timeout=30)
-        if response.status_code != 200:
-            print(f"[gist] failed to list gists: {response.status_code} {response.text}")
+        gist = _existing_gist(description, headers)
+        if not gist:
             return None
-        for gist in response.json():
-            if gist.get("description") == description:
-                return gist
+        if all("content" in info for info in (gist.get("files") or {}).values()):
+            return gist
+        # A listing entry: fetch the files' contents.
+        response = requests.get(f"https://api.github.com/gists/{gist['id']}", headers=headers, timeout=30)
+        if response.status_code == 200:
+            return response.json()
+        print(f"[gist] failed to fetch gist {gist['id']}: {response.status_code} {response.text}")
+        return gist
     except Exception as exc:
-        print(f"[gist] list error: {exc}")
+        print(f"[gist] fetch error: {exc}")
     return None
 
 
-def _upsert_gist(description, files, public=True):
+def _upsert_gist(description, files, public=True, prune=None):
+    """Create or update the gist titled ``description`` with ``files``.
+
+    ``None`` entries delete a file and are dropped for files the gist does not
+    have. Files already in the gist for which ``prune(name)`` is true and that
+    ``files`` does not mention are deleted as well.
+    """
     try:
         headers = _build_github_headers()
     except RuntimeError as exc:
         print(f"[gist] {exc}")
         return None
-    gist = _find_gist_by_description(description, headers)
     payload = {"description": description, "files": files}
     try:
+        response = None
+        gist = _existing_gist(description, headers)
         if gist:
-            gist_id = gist["id"]
+            existing = gist.get("files") or {}
+            payload["files"] = {
+                name: info for name, info in files.items() if info is not None or name in existing
+            }
+            if prune is not None:
+                payload["files"].update(
+                    (name, None) for name in existing if name not in files and prune(name)
+                )
             response = requests.patch(
-                f"https://api.github.com/gists/{gist_id}",
+                f"https://api.github.com/gists/{gist['id']}",
                 headers=headers,
                 json=payload,
                 timeout=30,
             )
-        else:
+            if response.status_code == 404:
+                # Deleted between the lookup and the PATCH: create it again below.
+                print(f"[gist] gist {gist['id']} for {description!r} is gone, creating a new one")
+                _remember_gist_id(description, None)
+                response = None
+        if response is None:
             payload["public"] = public
+            payload["files"] = {name: info for name, info in files.items() if info is not None}
             response = requests.post(
                 "https://api.github.com/gists",
                 headers=headers,
@@ -655,7 +1444,10 @@ def _upsert_gist(description, files, public=True):
     if response.status_code not in (200, 201):
         print(f"[gist] upsert failed ({description}): {response.status_code} {response.text}")
         return None
-    return response.json()
+    gist_data = response.json()
+    if gist_data.get("id"):
+        _remember_gist_id(description, gist_data["id"])
+    return gist_data
 
 
 def _build_gist_preview_url(gist_data, file_name):
@@ -665,7 +1457,12 @@ def _build_gist_preview_url(gist_data, file_name):
     gist_id = (gist_data.get("id") or "").strip()
     owner_login = ((gist_data.get("owner") or {}).get("login") or "").strip()
     if gist_id and owner_login:
-        return f"https://htmlpreview.github.io/?https://gist.githubusercontent.com/{owner_login}/{gist_id}/raw"
+        # Name the file: a bare /raw serves the alphabetically first file once
+        # the gist also carries the state (COMBINED_GIST).
+        return (
+            "https://htmlpreview.github.io/?https://gist.githubusercontent.com/"
+            f"{owner_login}/{gist_id}/raw/{file_name}"
+        )
 
     file_info = (gist_data.get("files") or {}).get(file_name) or {}
     raw_url = (file_info.get("raw_url") or "").strip()
@@ -674,52 +1471,253 @@ def _build_gist_preview_url(gist_data, file_name):
     return None
 
 
-def load_previous_state():
-    try:
-        headers = _build_github_headers()
-    except RuntimeError as exc:
-        print(f"[state] {exc}")
-        return {}
+def _pack_json(obj):
+    raw = json.dumps(obj, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+    return base64.b64encode(gzip.compress(raw.encode("utf-8"), mtime=0)).decode("ascii")
 
-    gist = _find_gist_by_description(STATE_GIST_DESCRIPTION, headers)
-    if not gist:
-        return {}
 
-    state_file = gist.get("files", {}).get(STATE_GIST_FILE)
-    if not state_file:
-        return {}
+def _unpack_json(text):
+    return json.loads(gzip.decompress(base64.b64decode(text)).decode("utf-8"))
 
-    content = state_file.get("content")
-    if content:
-        try:
-            return json.loads(content)
-        except json.JSONDecodeError:
-            print("[state] failed to decode state JSON from gist content")
 
-    raw_url = state_file.get("raw_url")
+class _StringTable:
+    """Numbers repeated color/size labels so a packed blob stores each once."""
+
+    def __init__(self, strings=()):
+        self.strings = list(strings)
+        self._index = {value: i for i, value in enumerate(self.strings)}
+
+    def ref(self, value):
+        if value is None:
+            return None
+        i = self._index.get(value)
+        if i is None:
+            i = self._index[value] = len(self.strings)
+            self.strings.append(value)
+        return i
+
+    def get(self, i):
+        return None if i is None else self.strings[i]
+
+
+def _map_labels(record, convert):
+    """Apply ``convert`` to the label fields of a snapshot record or size group."""
+    record = dict(record)
+    if "color" in record:
+        record["color"] = convert(record["color"])
+    if isinstance(record.get("sizes"), list):
+        record["sizes"] = [convert(size) for size in record["sizes"]]
+    return record
+
+
+def _map_state_labels(state, convert):
+    state = dict(state)
+    if isinstance(state.get("snapshot"), list):
+        state["snapshot"] = [_map_labels(rec, convert) for rec in state["snapshot"]]
+    for key in ("product_cache", "put_cache"):
+        if isinstance(state.get(key), dict):
+            state[key] = {
+                pid: dict(entry, groups=[_map_labels(g, convert) for g in entry.get("groups") or []])
+                for pid, entry in state[key].items()
+            }
+    return state
+
+
+def _pack_state(state):
+    table = _StringTable()
+    body = _map_state_labels(state, table.ref)
+    return _pack_json({"strings": table.strings, "state": body})
+
+
+def _unpack_state(text):
+    data = _unpack_json(text)
+    return _map_state_labels(data["state"], _StringTable(data["strings"]).get)
+
+
+def _snapshot_key(record):
+    return (record.get("pid") or "", record.get("name") or "", record.get("product_link") or "")
+
+
+def _state_delta(base, state):
+    """What turns ``base`` into ``state``: changed scalars, snapshot records and cache entries."""
+    delta = {"set": {}, "unset": []}
+    for key, value in state.items():
+        if key not in ("snapshot", "product_cache") and (key not in base or base[key] != value):
+            delta["set"][key] = value
+    delta["unset"] = [key for key in base if key not in state]
+
+    old_records = {_snapshot_key(rec): rec for rec in base.get("snapshot") or []}
+    new_records = {_snapshot_key(rec): rec for rec in state.get("snapshot") or []}
+    delta["snapshot"] = [rec for key, rec in new_records.items() if old_records.get(key) != rec]
+    delta["drop_snapshot"] = [list(key) for key in old_records if key not in new_records]
+
+    old_cache = base.get("product_cache") or {}
+    new_cache = state.get("product_cache") or {}
+    delta["put_cache"] = {pid: e for pid, e in new_cache.items() if old_cache.get(pid) != e}
+    delta["drop_cache"] = [pid for pid in old_cache if pid not in new_cache]
+    return delta
+
+
+def _apply_state_delta(base, delta):
+    state = {key: value for key, value in base.items() if key not in delta["unset"]}
+    state.update(delta["set"])
+
+    records = {_snapshot_key(rec): rec for rec in base.get("snapshot") or []}
+    for key in delta["drop_snapshot"]:
+        records.pop(tuple(key), None)
+    for rec in delta["snapshot"]:
+        records[_snapshot_key(rec)] = rec
+    state["snapshot"] = sorted(records.values(), key=_snapshot_key)
+
+    cache = dict(base.get("product_cache") or {})
+    for pid in delta["drop_cache"]:
+        cache.pop(pid, None)
+    cache.update(delta["put_cache"])
+    state["product_cache"] = cache
+    return state
+
+
+def _encode_state(state, description):
+    """Return the gist files to write for ``state`` and the checkpoint to remember.
+
+    The state file holds a small marker plus a packed delta against the
+    checkpoint file, so a normal save only rewrites the delta; the checkpoint
+    is re-cut from ``state`` when there is none yet, when it lives in another
+    gist than ``description`` (COMBINED_GIST switched on or off), or when the
+    delta has grown past STATE_DELTA_MAX_RATIO of it.
+    """
+    if not STATE_COMPACT:
+        return {STATE_GIST_FILE: {"content": json.dumps(state, ensure_ascii=False, sort_keys=True)}}, None
+
+    files = {}
+    checkpoint = _state_checkpoint
+    delta_blob = None
+    if checkpoint is not None and checkpoint.get("gist") != description:
+        checkpoint = None
+    if checkpoint is not None:
+        delta_blob = _pack_state(_state_delta(checkpoint["state"], state))
+        if len(delta_blob) > STATE_DELTA_MAX_RATIO * checkpoint["size"]:
+            delta_blob = None
+    if delta_blob is None:
+        blob = _pack_state(state)
+        checkpoint = {
+            "sha256": hashlib.sha256(blob.encode("ascii")).hexdigest(),
+            "state": copy.deepcopy(state),
+            "size": len(blob),
+            "gist": description,
+        }
+        files[STATE_CHECKPOINT_FILE] = {"content": blob}
+        delta_blob = _pack_state(_state_delta(checkpoint["state"], state))
+    marker = {
+        "format": "compact-delta",
+        "version": 1,
+        "checkpoint_file": STATE_CHECKPOINT_FILE,
+        "checkpoint_sha256": checkpoint["sha256"],
+        "delta": delta_blob,
+    }
+    files[STATE_GIST_FILE] = {"content": json.dumps(marker, sort_keys=True)}
+    return files, checkpoint
+
+
+def _read_gist_file(gist, file_name):
+    file_info = ((gist or {}).get("files") or {}).get(file_name)
+    if not file_info:
+        return None
+
+    content = file_info.get("content")
+    if content and not file_info.get("truncated"):
+        return content
+
+    raw_url = file_info.get("raw_url")
     if not raw_url:
-        return {}
+        return None
 
     try:
         response = requests.get(raw_url, timeout=20)
         if response.status_code != 200:
-            print(f"[state] failed to fetch raw state: {response.status_code}")
-            return {}
-        return json.loads(response.text)
+            print(f"[state] failed to fetch raw {file_name}: {response.status_code}")
+            return None
+        return response.text
     except Exception as exc:
-        print(f"[state] failed to load previous state: {exc}")
-    return {}
+        print(f"[state] failed to fetch raw {file_name}: {exc}")
+    return None
 
 
-def save_current_state(state):
-    content = json.dumps(state, ensure_ascii=False, sort_keys=True)
-    gist_data = _upsert_gist(
-        description=STATE_GIST_DESCRIPTION,
-        files={STATE_GIST_FILE: {"content": content}},
-        public=False,
-    )
+def _read_state_file(gist):
+    """Decode the state stored in ``gist``, plain JSON or compact-delta."""
+    global _state_checkpoint
+    content = _read_gist_file(gist, STATE_GIST_FILE)
+    if content is None:
+        return None
+    try:
+        state = json.loads(content)
+    except json.JSONDecodeError:
+        print("[state] failed to decode state JSON from gist content")
+        return None
+    if not isinstance(state, dict) or state.get("format") != "compact-delta":
+        return state
+
+    blob = _read_gist_file(gist, state.get("checkpoint_file") or STATE_CHECKPOINT_FILE)
+    if blob is None or hashlib.sha256(blob.encode("ascii")).hexdigest() != state.get("checkpoint_sha256"):
+        print("[state] checkpoint missing or does not match the delta, starting fresh")
+        return None
+    try:
+        base = _unpack_state(blob)
+        decoded = _apply_state_delta(base, _unpack_state(state["delta"]))
+    except Exception as exc:
+        print(f"[state] failed to decode compact state: {exc}")
+        return None
+    _state_checkpoint = {
+        "sha256": state["checkpoint_sha256"],
+        "state": base,
+        "size": len(blob),
+        "gist": gist.get("description"),
+    }
+    print(f"[state] loaded checkpoint ({len(blob):,} chars) + delta ({len(state['delta']):,} chars)")
+    return decoded
+
+
+def load_previous_state():
+    try:
+        headers = _build_github_headers()
+    except RuntimeError as exc:
+        print(f"[state] {exc}")
+        return {}
+
+    if COMBINED_GIST:
+        gist = _find_gist_by_description(PRODUCT_GIST_DESCRIPTION, headers)
+        state = _read_state_file(gist)
+        if state is not None:
+            # Known up front, so the alert can link the page that is then
+            # published together with the new state.
+            state["gist_url"] = _build_gist_preview_url(gist, PRODUCT_GIST_FILE)
+            return state
+        print("[state] no state in the product gist yet, reading the state gist")
+
+    gist = _find_gist_by_description(STATE_GIST_DESCRIPTION, headers)
+    return _read_state_file(gist) or {}
+
+
+def save_current_state(state, product_files=None):
+    """Save ``state``; in COMBINED_GIST mode ``product_files`` go out in the same PATCH."""
+    global _state_checkpoint
+    description = PRODUCT_GIST_DESCRIPTION if COMBINED_GIST else STATE_GIST_DESCRIPTION
+    files, checkpoint = _encode_state(state, description)
+    if COMBINED_GIST:
+        prune = None
+        if product_files:
+            files.update(product_files)
+            prune = _is_product_page_name
+        gist_data = _upsert_gist(description=description, files=files, public=True, prune=prune)
+    else:
+        gist_data = _upsert_gist(description=description, files=files, public=False)
     if gist_data:
-        print("[state] state saved")
+        _state_checkpoint = checkpoint
+        sizes = ", ".join(
+            f"{name} {len(info['content']):,} chars" if info else f"{name} removed"
+            for name, info in files.items()
+        )
+        print(f"[state] state saved ({sizes})")
         return True
     return False
 
@@ -736,6 +1734,7 @@ def _build_state_snapshot(items):
                 "discount_percent": item.get("discount_percent"),
                 "sizes": sorted(item.get("sizes") or []),
                 "product_link": item.get("product_link") or "",
+                "first_seen": item.get("first_seen"),
             }
         )
     snapshot.sort(key=lambda x: (x["pid"], x["name"], x["product_link"]))
@@ -794,6 +1793,39 @@ def _has_additions(diff):
     return bool(diff.get("new_products") or diff.get("added_sizes"))
 
 
+class _TokenBucket:
+    """Token bucket: ``burst`` sends back to back, then ``rate`` per second."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def acquire(self):
+        now = time.monotonic()
+        if now < self.blocked_until:
+            time.sleep(self.blocked_until - now)
+            now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            time.sleep((1 - self.tokens) / self.rate)
+            self.tokens = 1.0
+            self.updated = time.monotonic()
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        """Hold every send for ``seconds`` (Telegram's retry_after) and drop the burst."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+        self.updated = self.blocked_until
+
+
+_telegram_bucket = _TokenBucket(TELEGRAM_RATE, TELEGRAM_BURST)
+
+
 def send_telegram_message(content):
     bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
     chat_id = os.getenv("TELEGRAM_CHAT_ID")
@@ -807,78 +1839,186 @@ def send_telegram_message(content):
         "text": content,
         "disable_web_page_preview": True,
     }
-    try:
-        response = requests.post(url, json=payload, timeout=20)
-    except Exception as exc:
-        print(f"[telegram] send failed: {exc}")
-        return False
+    for attempt in range(TELEGRAM_RETRIES + 1):
+        _telegram_bucket.acquire()
+        delay = 2 ** attempt
+        try:
+            response = requests.post(url, json=payload, timeout=20)
+        except Exception as exc:
+            print(f"[telegram] send failed: {exc}")
+        else:
+            try:
+                body = response.json()
+            except ValueError:
+                body = {}
+            if response.status_code == 200 and body.get("ok"):
+                print("[telegram] message sent")
+                return True
+            retry_after = (body.get("parameters") or {}).get("retry_after")
+            if retry_after:
+                # Flood control: the bucket waits it out before the next attempt.
+                print(f"[telegram] rate limited, retry after {retry_after}s")
+                _telegram_bucket.pause(float(retry_after))
+                delay = 0
+            elif response.status_code < 500:
+                print(f"[telegram] send failed: {response.status_code} {response.text}")
+                return False
+            else:
+                print(f"[telegram] send failed: {response.status_code} {response.text}")
+        if attempt < TELEGRAM_RETRIES and delay:
+            time.sleep(delay)
+    return False
 
-    if response.status_code != 200:
-        print(f"[telegram] send failed: {response.status_code} {response.text}")
-        return False
 
-    body = response.json()
-    if not body.get("ok"):
-        print(f"[telegram] send failed: {body}")
-        return False
+def send_telegram_messages(messages, delivered):
+    """Send ``(text, keys)`` messages in order, stopping at the first failure.
 
-    print("[telegram] message sent")
+    The keys of every message that went out are added to ``delivered``, so a
+    caller can persist them and skip those entries when it retries.
+    """
+    for number, (text, keys) in enumerate(messages, 1):
+        if not send_telegram_message(text):
+            print(f"[telegram] stopped at message {number}/{len(messages)}")
+            return False
+        delivered.update(keys)
     return True
 
 
-def _format_telegram_update(diff, total_count, gist_url):
+def _delivery_key(kind, entry):
+    if kind == "new":
+        return f"new|{_item_key(entry)}"
+    return f"sizes|{_item_key(entry['item'])}|{'/'.join(entry['sizes'])}"
+
+
+def _telegram_entry_lines(item, detail):
+    name = (item.get("name") or "").strip() or "(Unnamed)"
+    lines = [f"- {name} | {detail}"]
+    product_link = (item.get("product_link") or "").strip()
+    if product_link:
+        lines.append(product_link)
+    return lines
+
+
+def _format_telegram_update(
+    diff, total_count, gist_url, delivered=(), title="Patagonia 折扣监控有追加", summary=False
+):
+    """Render ``diff`` as Telegram messages of at most TELEGRAM_MESSAGE_LIMIT chars.
+
+    Returns a list of ``(text, keys)``, where ``keys`` are the delivery keys of
+    the entries in that message. Entries whose key is already in ``delivered``
+    (streamed earlier, or sent by a run that failed part-way) are left out; if
+    none are left the list is empty, unless ``summary`` asks for the header
+    and link anyway.
+    """
     utc_now = datetime.now(timezone.utc)
     execution_time = utc_now.astimezone(JST).strftime("%Y-%m-%d %H:%M:%S JST")
 
-    new_products = diff.get("new_products") or []
-    added_sizes = diff.get("added_sizes") or []
+    new_products = []
+    for item in diff.get("new_products") or []:
+        key = _delivery_key("new", item)
+        if key not in delivered:
+            line = f"{item.get('discount_percent')}%"
+            if item.get("sale_price") is not None:
+                line += f" | ¥{item['sale_price']:,}"
+            new_products.append((key, _telegram_entry_lines(item, line)))
+    added_sizes = []
+    for entry in diff.get("added_sizes") or []:
+        key = _delivery_key("sizes", entry)
+        if key not in delivered:
+            added_sizes.append((key, _telegram_entry_lines(entry["item"], f"+{' / '.join(entry['sizes'])}")))
+    if not new_products and not added_sizes and not summary:
+        return []
 
-    lines = [
-        "Patagonia 折扣监控有追加",
-        f"更新时间: {execution_time}",
-        f"当前商品数量: {total_count}",
-        f"差分: 新增商品 {len(new_products)} 个, 新增尺码 {len(added_sizes)} 个",
-    ]
+    header = [title, f"更新时间: {execution_time}"]
+    if total_count is not None:
+        header.append(f"当前商品数量: {total_count}")
+    total_new = len(diff.get("new_products") or [])
+    total_sizes = len(diff.get("added_sizes") or [])
+    header.append(f"差分: 新增商品 {total_new} 个, 新增尺码 {total_sizes} 个")
+    already_sent = total_new + total_sizes - len(new_products) - len(added_sizes)
+    if summary and already_sent:
+        header.append(f"其中 {already_sent} 个已提前推送")
+    continued = f"{title} (续)"
+    # Leave room for the " [i/n]" added to each first line once the count is known.
+    limit = TELEGRAM_MESSAGE_LIMIT - len(" [999/999]")
+    chunks = []
+    lines, keys = list(header), []
+
+    def add(block, block_keys=(), title=None):
+        nonlocal lines, keys
+        if keys and len("\n".join(lines + block)) > limit:
+            chunks.append((lines, keys))
+            lines, keys = [continued], []
+            if title and block[1:2] != [title]:
+                block = ["", title] + block
+        lines = lines + block
+        keys.extend(block_keys)
+
+    for title, entries in (("新增商品:", new_products), ("新增尺码:", added_sizes)):
+        for position, (key, block) in enumerate(entries):
+            if position == 0:
+                block = ["", title] + block
+            add(block, [key], title)
+    if gist_url:
+        add(["", f"折扣列表: {gist_url}"])
+    chunks.append((lines, keys))
 
-    if new_products:
-        lines.append("")
-        lines.append("新增商品:")
-        for item in new_products[:MAX_TELEGRAM_ITEMS]:
-            name = (item.get("name") or "").strip() or "(Unnamed)"
-            discount = item.get("discount_percent")
-            sale_price = item.get("sale_price")
-            line = f"- {name} | {discount}%"
-            if sale_price is not None:
-                line += f" | ¥{sale_price:,}"
-            lines.append(line)
-            product_link = (item.get("product_link") or "").strip()
-            if product_link:
-                lines.append(product_link)
-        if len(new_products) > MAX_TELEGRAM_ITEMS:
-            lines.append(f"... 新增商品还有 {len(new_products) - MAX_TELEGRAM_ITEMS} 个")
-
-    if added_sizes:
-        lines.append("")
-        lines.append("新增尺码:")
-        for entry in added_sizes[:MAX_TELEGRAM_ITEMS]:
-            item = entry["item"]
-            sizes = entry["sizes"]
-            name = (item.get("name") or "").strip() or "(Unnamed)"
-            lines.append(f"- {name} | +{' / '.join(sizes)}")
-            product_link = (item.get("product_link") or "").strip()
-            if product_link:
-                lines.append(product_link)
-        if len(added_sizes) > MAX_TELEGRAM_ITEMS:
-            lines.append(f"... 新增尺码还有 {len(added_sizes) - MAX_TELEGRAM_ITEMS} 个")
+    if len(chunks) > 1:
+        for number, (chunk_lines, _) in enumerate(chunks, 1):
+            chunk_lines[0] += f" [{number}/{len(chunks)}]"
+    return [("\n".join(chunk_lines), chunk_keys) for chunk_lines, chunk_keys in chunks]
 
-    if gist_url:
-        lines.append("")
-        lines.append(f"折扣列表: {gist_url}")
 
-    message = "\n".join(lines)
-    if len(message) > 3900:
-        message = message[:3890] + "\n...(truncated)"
-    return message
+class _StreamingAlerts:
+    """Alerts on additions while round 2 runs instead of after the whole run.
+
+    Each finalized item is diffed against the previous snapshot index; new
+    entries are collected and sent once the oldest has waited ``window``
+    seconds. A timer does the sending, so a batch goes out on time even while
+    round 2 is blocked on a slow product page or only dropping items; flush()
+    sends what is left at the end. Delivered keys go into ``delivered`` so the
+    end-of-run message skips them.
+    """
+
+    def __init__(self, previous_snapshot, delivered, window=STREAM_ALERT_WINDOW):
+        self.previous_index = _build_snapshot_index(previous_snapshot)
+        self.delivered = delivered
+        self.window = window
+        self.pending = {"new_products": [], "added_sizes": []}
+        self.timer = None
+        self.failed = False
+        self._lock = threading.Lock()
+
+    def add(self, item):
+        record = _build_state_snapshot([item])[0]
+        previous = self.previous_index.get(_item_key(record))
+        diff = _compute_additions([previous] if previous else [], [record])
+        if not _has_additions(diff):
+            return
+        with self._lock:
+            self.pending["new_products"].extend(diff["new_products"])
+            self.pending["added_sizes"].extend(diff["added_sizes"])
+            if self.timer is None and not self.failed:
+                self.timer = threading.Timer(self.window, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        # Called by the timer thread and at the end of round 2; the lock keeps
+        # the two from sending the same batch or writing ``delivered`` at once.
+        with self._lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if self.failed or not _has_additions(self.pending):
+                return
+            pending, self.pending = self.pending, {"new_products": [], "added_sizes": []}
+            messages = _format_telegram_update(
+                pending, None, None, self.delivered, title="Patagonia 折扣速报"
+            )
+            if not send_telegram_messages(messages, self.delivered):
+                # Leave the rest to the end-of-run message.
+                self.failed = True
 
 
 def send_wechat_message(title, content):
@@ -1024,21 +2164,21 @@ class _Node:
         return (self.attrs.get("class") or "").lower()
 
     def iter(self):
-        yield self
-        for child in self.children:
-            yield from child.iter()
+        # Explicit stack instead of nested generators: pre-order, same sequence
+        # as the recursive walk but O(1) per node regardless of tree depth.
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            if node.children:
+                stack.extend(reversed(node.children))
 
     def text(self):
         parts = []
-
-        def _rec(node):
+        for node in self.iter():
             for chunk in node.text_parts:
                 if chunk and chunk.strip():
                     parts.append(chunk.strip())
-            for child in node.children:
-                _rec(child)
-
-        _rec(self)
         return " ".join(parts)
 
 
@@ -1082,13 +2222,53 @@ def _build_dom(html):
     return builder.root
 
 
-def _tile_image(tile):
-    for node in tile.iter():
-        if node.tag == "meta" and node.attr("itemprop") == "image" and node.attr("content"):
+_SALE_PRICE_ATTR_SET = frozenset(COLOR_SALE_PRICE_ATTRS)
+_LIST_PRICE_ATTR_SET = frozenset(COLOR_LIST_PRICE_ATTRS)
+
+
+class _TileIndex:
+    """Nodes of one product tile bucketed in a single traversal.
+
+    The _tile_* extractors only ever look at a handful of node kinds (anchors,
+    images, itemprop/data-url/price-attribute carriers, name-hint classes), so
+    we walk the tile once and keep those buckets in document order instead of
+    re-walking the subtree for every field.
+    """
+
+    __slots__ = ("tile", "by_tag", "itemprop", "price_nodes", "data_url_nodes", "name_hint_nodes")
+
+    def __init__(self, tile):
+        self.tile = tile
+        self.by_tag = {}
+        self.itemprop = {}
+        self.price_nodes = []
+        self.data_url_nodes = []
+        self.name_hint_nodes = []
+        for node in tile.iter():
+            self.by_tag.setdefault(node.tag, []).append(node)
+            attrs = node.attrs
+            if not attrs:
+                continue
+            prop = attrs.get("itemprop")
+            if prop:
+                self.itemprop.setdefault(prop, []).append(node)
+            if attrs.get("data-url"):
+                self.data_url_nodes.append(node)
+            if not _SALE_PRICE_ATTR_SET.isdisjoint(attrs) and not _LIST_PRICE_ATTR_SET.isdisjoint(attrs):
+                self.price_nodes.append(node)
+            cls = node.classes
+            if cls and any(hint in cls for hint in NAME_CLASS_HINTS):
+                self.name_hint_nodes.append(node)
+
+    def tag(self, name):
+        return self.by_tag.get(name, ())
+
+
+def _tile_image(index):
+    for node in index.itemprop.get("image", ()):
+        if node.tag == "meta" and node.attr("content"):
             return node.attr("content")
-    for node in tile.iter():
-        if node.tag != "img":
-            continue
+    for node in index.tag("img"):
         for attr in ("src", "data-src", "data-original"):
             value = node.attr(attr)
             if value:
@@ -1099,11 +2279,9 @@ def _tile_image(tile):
     return None
 
 
-def _tile_link(tile):
+def _tile_link(index):
     best = None
-    for node in tile.iter():
-        if node.tag != "a":
-            continue
+    for node in index.tag("a"):
         href = node.attr("href")
         if not href:
             continue
@@ -1116,35 +2294,31 @@ def _tile_link(tile):
     return best
 
 
-def _tile_name(tile):
-    for node in tile.iter():
-        if node.attr("itemprop") == "name":
-            text = node.text()
-            if text:
-                return text
-    for node in tile.iter():
-        cls = node.classes
-        if any(hint in cls for hint in NAME_CLASS_HINTS):
-            text = node.text()
-            if text:
-                return text
-    for node in tile.iter():
-        if node.tag == "a":
-            for attr in ("aria-label", "title"):
-                value = node.attr(attr)
-                if value and value.strip():
-                    return value.strip()
-            text = node.text()
-            if text:
-                return text
-    for node in tile.iter():
-        if node.tag == "img" and node.attr("alt"):
+def _tile_name(index):
+    for node in index.itemprop.get("name", ()):
+        text = node.text()
+        if text:
+            return text
+    for node in index.name_hint_nodes:
+        text = node.text()
+        if text:
+            return text
+    for node in index.tag("a"):
+        for attr in ("aria-label", "title"):
+            value = node.attr(attr)
+            if value and value.strip():
+                return value.strip()
+        text = node.text()
+        if text:
+            return text
+    for node in index.tag("img"):
+        if node.attr("alt"):
             return node.attr("alt").strip()
     return ""
 
 
-def _tile_prices(tile):
-    for node in tile.iter():
+def _tile_prices(index):
+    for node in index.price_nodes:
         sale = None
         listp = None
         for attr in COLOR_SALE_PRICE_ATTRS:
@@ -1159,14 +2333,12 @@ def _tile_prices(tile):
                 break
         if sale and listp and listp > 0:
             return sale, listp
-    return _extract_price_pair_from_text(tile.text())
+    return _extract_price_pair_from_text(index.tile.text())
 
 
-def _tile_qa_url(tile):
-    for node in tile.iter():
+def _tile_qa_url(index):
+    for node in index.data_url_nodes:
         data_url = node.attr("data-url")
-        if not data_url:
-            continue
         cls = node.classes
         low = data_url.lower()
         if "quickadd" in cls or "quick-add" in cls or "quickadd" in low or "showquickview" in low:
@@ -1174,14 +2346,7 @@ def _tile_qa_url(tile):
     return None
 
 
-def collect_tile_pids(html):
-    """Return all product-tile ``data-pid`` values present in a listing page.
-
-    Used to drive pagination: we advance/stop based on the raw set of product
-    tiles, independent of whether any of them happen to be discounted, so a page
-    full of full-price items does not look like "the end of the results".
-    """
-    root = _build_dom(html)
+def _collect_pids(root):
     pids = []
     seen = set()
     for tile in root.iter():
@@ -1192,126 +2357,806 @@ def collect_tile_pids(html):
     return pids
 
 
-def parse_listing_html(html, min_discount=0):
-    """Extract discounted product tiles from a rendered listing page's HTML.
+def _count_grid_tiles(root):
+    """Count ``data-pid`` nodes that are not inside another one (the grid tiles).
 
-    Returns a list of item dicts. Tiles without a usable sale/list price pair, or
-    whose discount does not exceed ``min_discount``, are skipped.
+    Variant swatches or carousels nested in a tile carry their own data-pid;
+    they are pids for pagination but do not count towards the ``sz`` honored.
     """
-    root = _build_dom(html)
-    items = []
-    seen_pids = set()
+    count = 0
+    for node in root.iter():
+        if not node.attr("data-pid"):
+            continue
+        parent = node.parent
+        while parent is not None and not parent.attr("data-pid"):
+            parent = parent.parent
+        if parent is None:
+            count += 1
+    return count
+
+
+def _iter_listing_items(root, min_discount, seen_pids):
     for tile in root.iter():
         pid = tile.attr("data-pid")
         if not pid or pid in seen_pids:
             continue
-        sale_price, list_price = _tile_prices(tile)
+        index = _TileIndex(tile)
+        sale_price, list_price = _tile_prices(index)
         if not sale_price or not list_price or list_price <= 0:
             continue
         discount_percent = round((list_price - sale_price) * 100 / list_price, 1)
         if discount_percent <= min_discount:
             continue
 
-        link = _tile_link(tile)
-        image = _tile_image(tile)
-        qa = _tile_qa_url(tile)
+        link = _tile_link(index)
+        image = _tile_image(index)
+        qa = _tile_qa_url(index)
         seen_pids.add(pid)
-        items.append({
+        yield {
             "pid": pid,
-            "name": _tile_name(tile),
+            "name": _tile_name(index),
             "original_price": int(list_price),
             "sale_price": int(sale_price),
             "discount_percent": discount_percent,
             "image_url": urljoin(BASE, image) if image else None,
             "product_link": urljoin(BASE, link) if link else None,
             "qa_url": urljoin(BASE, qa) if qa else None,
-        })
-    return items
+        }
 
 
-def fetch_discounted_products():
-    min_discount = 0
-    min_color_discount = 50
-    page_size = 48  # Salesforce Commerce Cloud grid size (sz parameter)
-    max_pages = 100  # 安全上限，避免站点忽略分页参数时陷入死循环
-    wait_timeout = 30
-    delay_between_pages = 1.5
+def _extract_listing_items(root, min_discount):
+    return list(_iter_listing_items(root, min_discount, set()))
+
+
+class _TileStreamParser(HTMLParser):
+    """Event-driven variant of _TreeBuilder that only keeps product tiles.
+
+    Outside a ``data-pid`` element only the open tag names are tracked (so end
+    tags close tiles exactly as they would in the full tree); inside one, the
+    tile subtree is built as usual, minus parent links, and handed to
+    ``finished`` once it closes. Memory therefore scales with the largest tile
+    rather than the whole page.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.outer = []
+        self.stack = []
+        self.finished = []
+        self.pending_text = []
+
+    def _flush_text(self):
+        # Text may arrive split across feed() chunks; join it before storing so
+        # the tile's text parts match what _TreeBuilder sees for the full page.
+        if self.pending_text:
+            data = "".join(self.pending_text)
+            self.pending_text = []
+            if self.stack and data.strip():
+                self.stack[-1].text_parts.append(data)
+
+    def _finish_tile(self):
+        self.finished.append(self.stack[0])
+        self.stack = []
+
+    def _open(self, tag, attrs, void):
+        self._flush_text()
+        attrs = {k: (v or "") for k, v in attrs}
+        if not self.stack:
+            if not attrs.get("data-pid"):
+                if not void:
+                    self.outer.append(tag)
+                return
+            node = _Node(tag, attrs)
+            if void:
+                self.finished.append(node)
+            else:
+                self.stack.append(node)
+            return
+        # No node.parent here: tile extraction never walks upwards, and without
+        # the back-reference a finished tile has no reference cycles, so it is
+        # freed as soon as it has been extracted instead of waiting for the GC.
+        node = _Node(tag, attrs)
+        self.stack[-1].children.append(node)
+        if not void:
+            self.stack.append(node)
+
+    def handle_starttag(self, tag, attrs):
+        self._open(tag, attrs, tag in _VOID_TAGS)
+
+    def handle_startendtag(self, tag, attrs):
+        self._open(tag, attrs, True)
+
+    def handle_endtag(self, tag):
+        self._flush_text()
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i].tag == tag:
+                if i == 0:
+                    self._finish_tile()
+                else:
+                    del self.stack[i:]
+                return
+        for i in range(len(self.outer) - 1, -1, -1):
+            if self.outer[i] == tag:
+                if self.stack:
+                    self._finish_tile()
+                del self.outer[i:]
+                return
+
+    def handle_data(self, data):
+        if self.stack and data:
+            self.pending_text.append(data)
+
+    def close(self):
+        super().close()
+        self._flush_text()
+        if self.stack:
+            self._finish_tile()
 
-    # ---------- 第 1 轮：渲染每页并用 parse_listing_html 解析列表 ----------
+
+def iter_listing_items(source, min_discount=0, chunk_size=64 * 1024):
+    """Stream discounted product tiles out of a listing page.
+
+    ``source`` is either the HTML string or a text file object, which is read
+    in ``chunk_size`` pieces. Yields the same item dicts, in the same order, as
+    ``parse_listing_html`` but never builds a tree for the whole page, so large
+    ``sz`` values or saved multi-megabyte pages only cost one tile of memory.
+    """
+    if isinstance(source, str):
+        chunks = (source[i:i + chunk_size] for i in range(0, len(source), chunk_size))
+    else:
+        chunks = iter(lambda: source.read(chunk_size), "")
+
+    parser = _TileStreamParser()
+    seen_pids = set()
+    done = False
+    while not done:
+        try:
+            chunk = next(chunks, None)
+            if chunk is None:
+                parser.close()
+                done = True
+            else:
+                parser.feed(chunk)
+        except Exception as exc:
+            print(f"[parse] stream parse error: {exc}")
+            done = True
+        finished, parser.finished = parser.finished, []
+        for tile in finished:
+            yield from _iter_listing_items(tile, min_discount, seen_pids)
+
+
+def collect_tile_pids(html):
+    """Return all product-tile ``data-pid`` values present in a listing page.
+
+    Used to drive pagination: we advance/stop based on the raw set of product
+    tiles, independent of whether any of them happen to be discounted, so a page
+    full of full-price items does not look like "the end of the results".
+    """
+    return _collect_pids(_build_dom(html))
+
+
+def parse_listing_html(html, min_discount=0):
+    """Extract discounted product tiles from a rendered listing page's HTML.
+
+    Returns a list of item dicts. Tiles without a usable sale/list price pair, or
+    whose discount does not exceed ``min_discount``, are skipped.
+    """
+    return _extract_listing_items(_build_dom(html), min_discount)
+
+
+def scan_listing_page(html, min_discount=0):
+    """Parse a listing page once and return ``(raw_pids, discounted_items)``.
+
+    Equivalent to ``collect_tile_pids(html)`` plus ``parse_listing_html(html,
+    min_discount)`` but builds the DOM a single time, which is what the crawl
+    loop needs for every page (pids for pagination, items for the result).
+    """
+    root = _build_dom(html)
+    return _collect_pids(root), _extract_listing_items(root, min_discount)
+
+
+# ---------------------------------------------------------------------------
+# Offline product detail parsing
+#
+# The live round-2 path asks the browser for every attribute of every color
+# option, one WebDriver round trip each. The same attributes are already in
+# driver.page_source, so parse_product_html runs the color/size/price logic
+# over the _Node DOM instead, via a minimal CSS matcher for the selector forms
+# used in SIZE_SELECTORS / COLOR_SELECTORS / PRICE_SELECTORS and a read-only
+# WebElement stand-in, so the extraction helpers are shared unchanged.
+# ---------------------------------------------------------------------------
+
+_SIMPLE_SELECTOR_RE = re.compile(
+    r"""
+      (?P<tag>^[a-zA-Z][\w-]*)
+    | \.(?P<cls>[\w-]+)
+    | \[(?P<attr>[\w-]+)(?:(?P<op>\*?=)['"]?(?P<val>[^'"\]]*)['"]?)?\]
+    | :not\((?P<neg>[^)]*)\)
+    """,
+    re.VERBOSE,
+)
+_compiled_selectors = {}
+
+
+def _compile_compound(text):
+    tests = []
+    pos = 0
+    while pos < len(text):
+        match = _SIMPLE_SELECTOR_RE.match(text, pos)
+        if not match or match.end() == pos:
+            raise ValueError(f"unsupported selector: {text!r}")
+        if match.group("tag"):
+            tests.append(("tag", match.group("tag").lower(), None, False))
+        elif match.group("cls"):
+            tests.append(("class", match.group("cls").lower(), None, False))
+        elif match.group("attr"):
+            tests.append(("attr", match.group("attr"), (match.group("op"), match.group("val")), False))
+        else:
+            for kind, name, arg, _ in _compile_compound(match.group("neg")):
+                tests.append((kind, name, arg, True))
+        pos = match.end()
+    return tests
+
+
+def _compile_selector(selector):
+    compiled = _compiled_selectors.get(selector)
+    if compiled is None:
+        compiled = [_compile_compound(part) for part in selector.split()]
+        _compiled_selectors[selector] = compiled
+    return compiled
+
+
+def _node_matches(node, tests):
+    for kind, name, arg, negate in tests:
+        if kind == "tag":
+            ok = node.tag == name
+        elif kind == "class":
+            ok = name in node.classes.split()
+        else:
+            value = node.attrs.get(name)
+            op, expected = arg
+            if op is None:
+                ok = value is not None
+            elif op == "*=":
+                ok = value is not None and expected in value
+            else:
+                ok = value == expected
+        if ok == negate:
+            return False
+    return True
+
+
+def _css_select(root, selector):
+    """Return descendants of ``root`` matching a descendant-combinator selector."""
+    compounds = _compile_selector(selector)
+    *ancestors, last = compounds
+    found = []
+    for node in root.iter():
+        if node is root or not _node_matches(node, last):
+            continue
+        pending = len(ancestors) - 1
+        parent = node.parent
+        while pending >= 0 and parent is not None and parent is not root:
+            if _node_matches(parent, ancestors[pending]):
+                pending -= 1
+            parent = parent.parent
+        if pending < 0:
+            found.append(node)
+    return found
+
+
+class _DomElement:
+    """Read-only stand-in for a Selenium WebElement backed by a _Node."""
+
+    __slots__ = ("node",)
+    _BOOLEAN_ATTRS = ("disabled", "checked", "selected")
+
+    def __init__(self, node):
+        self.node = node
+
+    @property
+    def tag_name(self):
+        return self.node.tag
+
+    @property
+    def text(self):
+        return self.node.text()
+
+    def get_attribute(self, name):
+        value = self.node.attrs.get(name)
+        if value is not None and name in self._BOOLEAN_ATTRS:
+            return "true"
+        return value
+
+    def find_elements(self, selector):
+        return [_DomElement(node) for node in _css_select(self.node, selector)]
+
+
+def _dom_color_data_element(element):
+    if element.tag_name == "button":
+        return element
+    buttons = element.find_elements("button")
+    return buttons[0] if buttons else element
+
+
+def parse_product_html(html):
+    """Extract color/size/price groups from a product detail page's HTML.
+
+    Mirrors the attribute path of _collect_sizes_by_color (and the plain size
+    list when the page has no color options) without a browser. Colors whose
+    data attributes carry no prices keep ``None`` prices; the caller decides
+    whether the live click path is needed to fill them in.
+    """
+    page = _DomElement(_build_dom(html))
+    elements = _find_first(page.find_elements, COLOR_SELECTORS)
+    if not elements:
+        sizes = _collect_sizes(page.find_elements)
+        return [{"color": None, "sizes": sizes}] if sizes else []
+    results, _ = _collect_color_groups_from_attrs(elements, _dom_color_data_element)
+    return results
+
+
+def _product_groups_complete(groups):
+    # True when the live path would not have anything to add: either a plain
+    # size list (no color options) or every color carries its own prices.
+    return bool(groups) and all(
+        group.get("color") is None or (group.get("sale_price") and group.get("list_price"))
+        for group in groups
+    )
+
+
+def _fetch_listing_html_http(url, timeout=20):
+    response = _http_get(
+        url,
+        headers={"X-Requested-With": "XMLHttpRequest"},
+        timeout=timeout,
+        label="listing http",
+    )
+    if response is None:
+        return None
+    if response.status_code != 200:
+        print(f"[listing http] status {response.status_code} for {url}")
+        return None
+    return response.text
+
+
+def _fetch_listing_html_selenium(url, wait_timeout):
+    # The crawl calls this from a short-lived executor thread, so the driver
+    # goes back to the pool after every page for round 2 (and the next check).
+    pool = _get_driver_pool()
+    try:
+        drv = pool.acquire()
+    except Exception as exc:
+        print(f"[listing selenium] could not start a driver for {url}: {exc}")
+        return None
+    try:
+        try:
+            drv.get(url)
+        except TimeoutException as exc:
+            print(f"[listing selenium] navigation timeout on {url}: {exc}")
+            return None
+        except WebDriverException as exc:
+            print(f"[listing selenium] driver failed on {url}: {exc}")
+            pool.discard(drv)
+            drv = None
+            return None
+        except Exception as exc:
+            print(f"[listing selenium] navigation error on {url}: {exc}")
+            return None
+        # 改版に強い待機条件：テーマ依存のクラスではなく data-pid の出現を待つ。
+        try:
+            WebDriverWait(drv, wait_timeout, poll_frequency=0.1).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, "[data-pid]"))
+            )
+        except TimeoutException:
+            print(f"[listing selenium] wait timeout (no [data-pid]) on {url}")
+            return None
+        return drv.page_source
+    finally:
+        if drv is not None:
+            pool.release(drv)
+
+
+def _listing_page_ended(future):
+    # Cheap look-ahead for the concurrent crawl: a prefetched page that already
+    # came back empty means there is no point scheduling offsets beyond it.
+    if not future.done():
+        return False
+    try:
+        html = future.result()
+    except Exception:
+        return True
+    return html is None or "data-pid" not in html
+
+
+def _crawl_listing(fetch_page, page_size, max_pages, min_discount, concurrency=1):
+    """Walk the start/sz listing pages until no new product tiles show up.
+
+    ``fetch_page(page, start, sz)`` returns the page HTML, or None to stop.
+    Page 1 is requested with ``page_size``; if it comes back with fewer tiles
+    the site caps (or ignores) ``sz``, so later offsets step by the observed
+    count instead, which can only overlap (deduped by pid), never skip. With
+    ``concurrency`` > 1 up to that many pages are fetched in parallel once page
+    1 has come back, but results are still consumed strictly in offset order,
+    so the stop conditions and pid dedupe behave exactly as in a serial crawl;
+    pages already in flight past the last one are simply discarded. If page 1
+    fails or has no tiles at a ``page_size`` above LISTING_PAGE_SIZE_RETRY, it
+    is requested once more with that smaller size before giving up.
+    Returns ``(items, pages, page_size)`` with the discounted items
+    deduplicated by pid and the page size actually used after page 1.
+    """
     # patagonia.jp 基于 Salesforce Commerce Cloud（Demandware），列表分页使用
     # start（偏移量）+ sz（每页数量），而不是 ?page=N。用 ?page=N 会被忽略，
     # 导致每一页都返回第一页内容，于是只抓到一页。这里改为 start/sz 遍历。
-    drv = _get_driver()
     items = []
     seen_pids = set()        # 已收录的折扣商品 pid
     seen_raw_pids = set()    # 已见过的全部商品 pid（含原价），用于判断是否到末页
-    # 改版に強い待機条件：テーマ依存のクラスではなく data-pid の出現を待つ。
-    wait_selector = "[data-pid]"
     page = 1
-    start = 0
-    while True:
-        if page > max_pages:
-            print(f"[paging] reached max_pages={max_pages}, stop")
-            break
-        url = f"{BASE}/shop/web-specials?start={start}&sz={page_size}"
-        print(f"[page {page}] fetching {url}")
-        try:
-            drv.get(url)
-        except Exception as exc:
-            print(f"[page {page}] navigation error: {exc}")
-            break
-        try:
-            WebDriverWait(drv, wait_timeout).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, wait_selector))
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        in_flight = {}
+        next_page = 1
+        while True:
+            if page > max_pages:
+                print(f"[paging] reached max_pages={max_pages}, stop")
+                break
+            # 第 1 页单独请求；确认有商品后再并发预取后续页。
+            window = concurrency if page > 1 else 1
+            while (
+                next_page <= max_pages
+                and next_page < page + window
+                and not any(_listing_page_ended(f) for f in in_flight.values())
+            ):
+                start = (next_page - 1) * page_size
+                in_flight[next_page] = pool.submit(fetch_page, next_page, start, page_size)
+                next_page += 1
+            try:
+                html = in_flight.pop(page).result()
+            except Exception as exc:
+                print(f"[paging] error fetching page {page}: {exc}")
+                html = None
+            root = _build_dom(html) if html is not None else None
+            raw_pids = _collect_pids(root) if root is not None else []
+            if page == 1 and not raw_pids and page_size > LISTING_PAGE_SIZE_RETRY:
+                # An oversized sz may be rejected outright rather than capped.
+                print(f"[paging] sz={page_size} gave no tiles, retrying with sz={LISTING_PAGE_SIZE_RETRY}")
+                page_size = LISTING_PAGE_SIZE_RETRY
+                next_page = 1
+                continue
+            if html is None:
+                print(f"[paging] page {page} unavailable, stop")
+                break
+            if not raw_pids:
+                print(f"[paging] no product tiles on page {page}, stop")
+                break
+            page_items = _extract_listing_items(root, min_discount)
+            if page == 1:
+                tile_count = _count_grid_tiles(root)
+                if tile_count < page_size:
+                    print(f"[paging] sz={page_size} returned {tile_count} tiles, using sz={tile_count}")
+                    page_size = tile_count
+
+            new_raw_pids = [pid for pid in raw_pids if pid not in seen_raw_pids]
+            if not new_raw_pids:
+                # 没有任何新商品出现：站点要么到达末页，要么忽略了分页参数。
+                print(f"[paging] no new product tiles on page {page}, stop")
+                break
+            seen_raw_pids.update(raw_pids)
+
+            new_items = [it for it in page_items if it["pid"] not in seen_pids]
+            print(
+                f"[page {page}] {len(raw_pids)} tiles ({len(new_raw_pids)} new),"
+                f" {len(page_items)} discounted, {len(new_items)} new discounted"
             )
-        except TimeoutException:
-            print(f"[page {page}] wait timeout (no [data-pid]), stop paging")
-            break
+            for it in new_items:
+                seen_pids.add(it["pid"])
+                items.append(it)
+
+            page += 1
+        for future in in_flight.values():
+            future.cancel()
+    return items, page, page_size
+
+
+def crawl_listing_http(
+    url_template,
+    page_size=LISTING_PAGE_SIZE_PROBE,
+    max_pages=100,
+    min_discount=0,
+    delay=0.3,
+    concurrency=LISTING_CONCURRENCY,
+):
+    """Crawl the listing over plain HTTP only (no browser).
 
-        page_source = drv.page_source
-        raw_pids = collect_tile_pids(page_source)
-        if not raw_pids:
-            print(f"[paging] no product tiles on page {page}, stop")
-            break
+    ``url_template`` must contain ``{start}`` and ``{sz}``. Also usable against
+    a local stand-in server serving saved pages (see --listing-url).
+    """
+    def fetch_page(page, start, sz):
+        if page > 1:
+            time.sleep(delay)
+        url = url_template.format(start=start, sz=sz)
+        print(f"[page {page}] fetching {url} (http)")
+        return _fetch_listing_html_http(url)
 
-        new_raw_pids = [pid for pid in raw_pids if pid not in seen_raw_pids]
-        if not new_raw_pids:
-            # 没有任何新商品出现：站点要么到达末页，要么忽略了分页参数。
-            print(f"[paging] no new product tiles on page {page}, stop")
-            break
-        seen_raw_pids.update(raw_pids)
+    return _crawl_listing(fetch_page, page_size, max_pages, min_discount, concurrency)
 
-        page_items = parse_listing_html(page_source, min_discount=min_discount)
-        new_items = [it for it in page_items if it["pid"] not in seen_pids]
-        print(
-            f"[page {page}] {len(raw_pids)} tiles ({len(new_raw_pids)} new),"
-            f" {len(page_items)} discounted, {len(new_items)} new discounted"
+
+class ProductCache:
+    """SQLite cache of scraped per-color sizes and prices, one row per group.
+
+    Rows are keyed by pid + position in the scraped group list, so groups that
+    share a color label (or have none) all come back from ``get``.
+
+    All rows of one product share the listing signature they were scraped under
+    and a fetch timestamp; ``get`` only returns them while both still hold.
+    ``evict`` drops expired products, then the least recently read ones until
+    at most ``max_products`` remain.
+    """
+
+    def __init__(self, path, ttl_hours=ROUND2_CACHE_TTL_HOURS, max_products=PRODUCT_CACHE_MAX_PRODUCTS):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.ttl = ttl_hours * 3600
+        self.max_products = max_products
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS product_groups (
+                pid TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                color TEXT,
+                signature TEXT NOT NULL,
+                sizes TEXT NOT NULL,
+                sale_price REAL,
+                list_price REAL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (pid, position)
+            )
+            """
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS product_groups_accessed ON product_groups (accessed_at)"
+        )
+        self.conn.commit()
+
+    def get(self, pid, signature=None, check_ttl=True):
+        rows = self.conn.execute(
+            "SELECT color, signature, sizes, sale_price, list_price, fetched_at"
+            " FROM product_groups WHERE pid = ? ORDER BY position",
+            (pid,),
+        ).fetchall()
+        if not rows:
+            return None
+        if signature is not None and rows[0][1] != signature:
+            return None
+        if check_ttl and (not self.ttl or time.time() - rows[0][5] > self.ttl):
+            return None
+        self.conn.execute(
+            "UPDATE product_groups SET accessed_at = ? WHERE pid = ?", (time.time(), pid)
         )
-        for it in new_items:
-            seen_pids.add(it["pid"])
-            items.append(it)
+        self.conn.commit()
+        return [
+            {
+                "color": color,
+                "sizes": json.loads(sizes),
+                "sale_price": sale_price,
+                "list_price": list_price,
+            }
+            for color, _, sizes, sale_price, list_price, _ in rows
+        ]
+
+    def put(self, pid, signature, groups, fetched_at=None):
+        now = time.time()
+        fetched_at = fetched_at or now
+        with self.conn:
+            self.conn.execute("DELETE FROM product_groups WHERE pid = ?", (pid,))
+            self.conn.executemany(
+                "INSERT INTO product_groups"
+                " (pid, position, color, signature, sizes, sale_price, list_price,"
+                "  fetched_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        pid,
+                        position,
+                        group.get("color"),
+                        signature,
+                        json.dumps(group.get("sizes") or [], ensure_ascii=False),
+                        group.get("sale_price"),
+                        group.get("list_price"),
+                        fetched_at,
+                        now,
+                    )
+                    for position, group in enumerate(groups)
+                ],
+            )
+
+    def evict(self):
+        with self.conn:
+            if self.ttl:
+                self.conn.execute(
+                    "DELETE FROM product_groups WHERE fetched_at < ?", (time.time() - self.ttl,)
+                )
+            self.conn.execute(
+                "DELETE FROM product_groups WHERE pid NOT IN ("
+                " SELECT pid FROM product_groups GROUP BY pid"
+                " ORDER BY MAX(accessed_at) DESC LIMIT ?)",
+                (self.max_products,),
+            )
+        count = self.conn.execute("SELECT COUNT(DISTINCT pid) FROM product_groups").fetchone()[0]
+        print(f"[cache] {self.path}: {count} products after eviction")
+
+    def close(self):
+        self.conn.close()
+
+
+def _open_product_cache(path=PRODUCT_CACHE_PATH):
+    if not path:
+        return None
+    try:
+        return ProductCache(path)
+    except Exception as exc:
+        print(f"[cache] cannot open product cache {path}: {exc}")
+        return None
+
+
+def _format_size_groups(groups):
+    sizes = []
+    for group in groups:
+        color_label = group.get("color") or ""
+        size_text = " ".join(group.get("sizes", []))
+        if not size_text:
+            continue
+        if color_label:
+            sizes.append(f"{color_label}: {size_text}")
+        else:
+            sizes.append(size_text)
+    return sizes
+
 
-        page += 1
-        start += page_size
-        time.sleep(delay_between_pages)
+def _listing_signature(item):
+    """What the listing says about an item; round-2 results stay valid while it holds."""
+    return "|".join(
+        str(item.get(key) or "") for key in ("pid", "sale_price", "original_price", "qa_url")
+    )
+
+
+def _cached_product_groups(entry, signature, now):
+    """Return a copy of a cached entry's groups if it still applies, else None."""
+    if not entry or not ROUND2_CACHE_TTL_HOURS or entry.get("signature") != signature:
+        return None
+    try:
+        fetched_at = datetime.fromisoformat(entry.get("fetched_at") or "")
+    except ValueError:
+        return None
+    if fetched_at.tzinfo is None:
+        fetched_at = fetched_at.replace(tzinfo=timezone.utc)
+    if now - fetched_at > timedelta(hours=ROUND2_CACHE_TTL_HOURS):
+        return None
+    return copy.deepcopy(entry.get("groups")) or None
+
+
+def fetch_discounted_products(crawl_state=None, on_item=None):
+    """Run both scraping rounds and return ``(items, pages)``.
+
+    ``pages`` maps gist file names to the rendered products HTML (see
+    render_product_pages).
+
+    ``crawl_state`` is a dict persisted in the state gist between runs; the
+    listing page size learned in round 1 is read from and written back to
+    its ``listing_page_size`` key, and the per-product color/size groups
+    scraped in round 2 to its ``product_cache`` key. ``on_item``, if given,
+    is called with each product as soon as round 2 keeps it.
+    """
+    if crawl_state is None:
+        crawl_state = {}
+    min_discount = 0
+    min_color_discount = 50
+    # Salesforce Commerce Cloud grid size (sz parameter). Start from the size
+    # learned on a previous run, otherwise probe with a large one.
+    page_size = crawl_state.get("listing_page_size") or LISTING_PAGE_SIZE_PROBE
+    max_pages = 100  # 安全上限，避免站点忽略分页参数时陷入死循环
+    wait_timeout = 30
+    delay_between_pages = 1.5
+    http_delay_between_pages = 0.3
+
+    # ---------- 第 1 轮：抓取每页列表并用 scan_listing_page 解析 ----------
+    # 先用 HTTP 直接请求 SFCC 的商品网格片段（无需渲染页面，可并发）；只有当
+    # HTTP 第 1 页就拿不到任何 data-pid 商品时才退回 Selenium 逐页渲染。
+    items, page, used_page_size = crawl_listing_http(
+        LISTING_GRID_URL,
+        page_size=page_size,
+        max_pages=max_pages,
+        min_discount=min_discount,
+        delay=http_delay_between_pages,
+    )
+    if page == 1:
+        print("[round1] http listing has no product tiles, falling back to selenium")
+        # delay_between_pages 只作为两次页面加载之间的最小间隔（礼貌下限）。
+        throttle = _Throttle(delay_between_pages)
+
+        def fetch_page(page, start, sz):
+            throttle.wait()
+            url = LISTING_URL.format(start=start, sz=sz)
+            print(f"[page {page}] fetching {url} (selenium)")
+            return _fetch_listing_html_selenium(url, wait_timeout)
+
+        items, page, used_page_size = _crawl_listing(fetch_page, page_size, max_pages, min_discount)
+
+    # Only trust a shrunken sz once a second page confirmed it was a cap; a
+    # single short page just means the whole catalog fit into the request.
+    if page > 2:
+        crawl_state["listing_page_size"] = used_page_size
+    elif page == 2:
+        crawl_state["listing_page_size"] = page_size
+    print(f"[round1] listing page size for next run: {crawl_state.get('listing_page_size')}")
 
     print(f"[round1] collected {len(items)} discounted products across {page} page(s)")
 
-    # ---------- 第 2 轮：为每个 item 在新标签页里采集尺码 ----------
-    main_window = driver.current_window_handle
-    processed_items = []
-    for it in items:
+    # ---------- 第 2 轮：多个浏览器并行打开商品页采集尺码 ----------
+    # 商品页由 ROUND2_WORKERS 个 Chrome 并行抓取，结果仍按原顺序逐个处理。
+    # quick-add 尺码作为兜底，用 HTTP 线程池在浏览器工作的同时预取。
+    # 列表签名（pid + 售价/原价 + qa_url）未变且缓存未过期的商品直接复用上次的结果。
+    previous_cache = crawl_state.get("product_cache") or {}
+    product_cache = {}
+    now = datetime.now(timezone.utc)
+    signatures = [_listing_signature(it) for it in items]
+    cached = [
+        _cached_product_groups(previous_cache.get(it["pid"]), signature, now)
+        for it, signature in zip(items, signatures)
+    ]
+    from_state = [groups is not None for groups in cached]
+    disk_cache = _open_product_cache()
+    if disk_cache is not None:
+        for i, (it, signature) in enumerate(zip(items, signatures)):
+            if cached[i] is None:
+                cached[i] = disk_cache.get(it["pid"], signature)
+    print(
+        f"[round2] reusing cached groups for {sum(g is not None for g in cached)}"
+        f"/{len(items)} products"
+    )
+
+    pool = _get_driver_pool()
+    executor = ThreadPoolExecutor(max_workers=max(1, ROUND2_WORKERS))
+    qa_executor = ThreadPoolExecutor(max_workers=QUICKADD_WORKERS)
+    qa_futures = {}
+    futures = []
+    for it, groups in zip(items, cached):
+        if groups is not None:
+            futures.append(None)
+            continue
         qa_url = it.get("qa_url")
-        product_link = it.get("product_link")
-        sizes = []
+        if qa_url and qa_url not in qa_futures:
+            qa_futures[qa_url] = qa_executor.submit(_fetch_sizes_from_quick_add, qa_url)
+        futures.append(executor.submit(_scrape_product_page, pool, it.get("product_link")))
 
-        color_size_groups = _fetch_sizes_from_product_page(product_link, main_window)
+    processed_items = []
+    for it, signature, groups, in_state, future in zip(items, signatures, cached, from_state, futures):
+        qa_url = it.get("qa_url")
 
-        if not color_size_groups and qa_url:
-            quick_sizes = _fetch_sizes_from_quick_add(qa_url)
-            if quick_sizes:
-                color_size_groups = [{"color": None, "sizes": quick_sizes}]
-                print(f"[sizes quickadd] collected {len(quick_sizes)} sizes for {qa_url}")
+        if groups is not None:
+            color_size_groups = groups
+            if in_state:
+                product_cache[it["pid"]] = previous_cache[it["pid"]]
+        else:
+            color_size_groups = future.result()
+
+            if not color_size_groups and qa_url:
+                quick_sizes = qa_futures[qa_url].result()
+                if quick_sizes:
+                    color_size_groups = [{"color": None, "sizes": quick_sizes}]
+                    print(f"[sizes quickadd] collected {len(quick_sizes)} sizes for {qa_url}")
+
+            if color_size_groups:
+                product_cache[it["pid"]] = {
+                    "signature": signature,
+                    "groups": copy.deepcopy(color_size_groups),
+                    "fetched_at": now.isoformat(),
+                }
+                if disk_cache is not None:
+                    disk_cache.put(it["pid"], signature, color_size_groups)
 
         fallback_color = _infer_color_from_image_url(
             it.get("image_url"),
@@ -1339,17 +3184,18 @@ def fetch_discounted_products():
                 it["discount_percent"] = round((g_list - g_sale) * 100 / g_list, 1)
                 break
 
-        for group in color_size_groups:
-            color_label = group.get("color") or ""
-            size_text = " ".join(group.get("sizes", []))
-            if not size_text:
-                continue
-            if color_label:
-                sizes.append(f"{color_label}: {size_text}")
-            else:
-                sizes.append(size_text)
-
+        sizes = _format_size_groups(color_size_groups)
         it["sizes"] = sizes
+        it["color_sizes"] = [
+            {
+                "color": group.get("color"),
+                "sizes": list(group.get("sizes") or []),
+                "sale_price": group.get("sale_price"),
+                "list_price": group.get("list_price"),
+            }
+            for group in color_size_groups
+            if group.get("sizes")
+        ]
         if not sizes:
             print(
                 f"[filter] {it.get('name')}: no colors at >= {min_color_discount}%"
@@ -1360,6 +3206,8 @@ def fetch_discounted_products():
         if TEST_STOP_AFTER_FILTERED_PRODUCTS:
             if sizes and (has_color_price_data or not TEST_REQUIRE_COLOR_PRICE_DATA):
                 processed_items.append(it)
+                if on_item is not None:
+                    on_item(it)
                 if len(processed_items) >= TEST_STOP_AFTER_FILTERED_PRODUCTS:
                     test_mode = (
                         "color-filtered"
@@ -1374,64 +3222,236 @@ def fetch_discounted_products():
             continue
 
         processed_items.append(it)
-
+        if on_item is not None:
+            on_item(it)
+
+    for future in futures + list(qa_futures.values()):
+        if future is not None:
+            future.cancel()
+    executor.shutdown(wait=True)
+    qa_executor.shutdown(wait=True)
+    _report_wait_totals()
+    if disk_cache is not None:
+        disk_cache.evict()
+        disk_cache.close()
+    crawl_state["product_cache"] = product_cache
     items = processed_items
 
-    return items, render_products_html(items)
-
-
-def render_products_html(items):
-    execution_time = datetime.now(timezone.utc).astimezone(JST).strftime("%Y-%m-%d %H:%M:%S")
-
-    html_content = f"""
-    <!DOCTYPE html>
-    <html lang="ja">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Patagonia Discounted Products</title>
-        <style>
-            body {{ font-family: Arial, sans-serif; }}
-            .product {{ border: 1px solid #ddd; padding: 10px; margin: 10px 0; }}
-            .product img {{ max-width: 200px; }}
-            .product h2 {{ font-size: 1.2em; color: #333; }}
-            .price {{ font-weight: bold; color: #d9534f; }}
-            .original-price {{ text-decoration: line-through; color: #888; }}
-            .timestamp {{ color: #555; font-size: 0.9em; margin-top: 10px; }}
-            .sizes {{ margin-top: 5px; color: #555; font-size: 0.9em; }}
-        </style>
-    </head>
-    <body>
-        <h1>Discounted Products</h1>
-        <p class="timestamp">Generated on: {execution_time}</p>
+    return items, render_product_pages(items)
+
+
+_PRODUCTS_HTML_HEAD = """<!DOCTYPE html>
+<html lang="ja">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{title}</title>
+    <style>
+        body {{ font-family: Arial, sans-serif; }}
+        .product {{ border: 1px solid #ddd; padding: 10px; margin: 10px 0; }}
+        .product img {{ max-width: 200px; height: auto; }}
+        .product h2 {{ font-size: 1.2em; color: #333; }}
+        .price {{ font-weight: bold; color: #d9534f; }}
+        .original-price {{ text-decoration: line-through; color: #888; }}
+        .timestamp {{ color: #555; font-size: 0.9em; margin-top: 10px; }}
+        .sizes {{ margin-top: 5px; color: #555; font-size: 0.9em; }}
+        .pager a, .pager strong {{ margin-right: 8px; }}
+    </style>
+</head>
+<body>
+    <h1>Discounted Products</h1>
+    <p class="timestamp">Generated on: {generated_at}</p>
+"""
+
+_PRODUCTS_HTML_TAIL = """</body>
+</html>
+"""
+
+
+def _product_page_name(number):
+    if number == 1:
+        return PRODUCT_GIST_FILE
+    stem, ext = os.path.splitext(PRODUCT_GIST_FILE)
+    return f"{stem}_p{number}{ext}"
+
+
+def _resized_image_url(url, width=RENDER_IMAGE_WIDTH):
+    """Ask the Commerce Cloud image service (``/dw/image/`` URLs) for a ``width``-px copy.
+
+    Other URLs are returned unchanged.
     """
-
+    if not url or not width or "/dw/image/" not in url:
+        return url
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query, keep_blank_values=True))
+    query.update({"sw": str(width), "sh": str(width), "q": "80"})
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def _format_yen(value):
+    return f"¥ {value:,}" if isinstance(value, (int, float)) else "-"
+
+
+def _product_html(p):
+    name = escape(p.get("name") or "")
+    link = escape(p.get("product_link") or "#")
+    image = escape(_resized_image_url(p.get("image_url")) or "")
+    sizes = p.get("sizes") or []
+    return f"""    <div class="product">
+        <h2>{name}</h2>
+        <a href="{link}" target="_blank" rel="noopener">
+            <img src="{image}" alt="{name}" width="{RENDER_IMAGE_WIDTH // 2}" loading="lazy" decoding="async">
+        </a>
+        <p class="original-price">Original Price: {_format_yen(p.get('original_price'))}</p>
+        <p class="price">Sale Price: {_format_yen(p.get('sale_price'))}</p>
+        <p>Discount Percent: {escape(str(p.get('discount_percent')))}%</p>
+        <p class="sizes">Sizes: {escape(" | ".join(sizes)) if sizes else "-"}</p>
+    </div>
+"""
+
+
+def _pager_html(page, page_count):
+    if page_count <= 1:
+        return ""
+    links = []
+    for number in range(1, page_count + 1):
+        if number == page:
+            links.append(f"<strong>{number}</strong>")
+        else:
+            links.append(f'<a href="{escape(_product_page_name(number))}">{number}</a>')
+    return f'    <p class="pager">{" ".join(links)}</p>\n'
+
+
+def iter_products_html(items, generated_at=None, page=1, page_count=1):
+    """Yield the products page in pieces, so it can be streamed to a file."""
+    if generated_at is None:
+        generated_at = datetime.now(timezone.utc).astimezone(JST).strftime("%Y-%m-%d %H:%M:%S")
+    title = "Patagonia Discounted Products"
+    if page_count > 1:
+        title += f" ({page}/{page_count})"
+    yield _PRODUCTS_HTML_HEAD.format(title=escape(title), generated_at=escape(generated_at))
+    pager = _pager_html(page, page_count)
+    yield pager
     for p in items:
-        sizes = p.get("sizes") or []
-        html_content += f"""
-        <div class="product">
-            <h2>{p['name']}</h2>
-            <a href="{p['product_link'] or '#'}" target="_blank">
-                <img src="{p['image_url'] or ''}" alt="{p['name']}">
-            </a>
-            <p class="original-price">Original Price: ¥ {p['original_price']:,}</p>
-            <p class="price">Sale Price: ¥ {p['sale_price']:,}</p>
-            <p>Discount Percent: {p['discount_percent']}%</p>
-            <p class="sizes">Sizes: {" | ".join(sizes) if sizes else "-"}</p>
-        </div>
-        """
-
-    html_content += """
-    </body>
-    </html>
-    """
-    return html_content
+        yield _product_html(p)
+    yield pager
+    yield _PRODUCTS_HTML_TAIL
+
+
+def write_products_html(items, fp, **kwargs):
+    for chunk in iter_products_html(items, **kwargs):
+        fp.write(chunk)
+
+
+def render_products_html(items, **kwargs):
+    buffer = io.StringIO()
+    write_products_html(items, buffer, **kwargs)
+    return buffer.getvalue()
+
+
+def render_product_pages(items, page_size=PRODUCTS_PAGE_SIZE):
+    """Render ``items`` as ``{file_name: html}``, ``page_size`` products per page."""
+    generated_at = datetime.now(timezone.utc).astimezone(JST).strftime("%Y-%m-%d %H:%M:%S")
+    if page_size <= 0 or len(items) <= page_size:
+        return {PRODUCT_GIST_FILE: render_products_html(items, generated_at=generated_at)}
+    page_count = (len(items) + page_size - 1) // page_size
+    return {
+        _product_page_name(page): render_products_html(
+            items[(page - 1) * page_size:page * page_size],
+            generated_at=generated_at,
+            page=page,
+            page_count=page_count,
+        )
+        for page in range(1, page_count + 1)
+    }
+
+
+def _product_gist_files(pages):
+    """Gist ``files`` for the rendered pages."""
+    return {name: {"content": content} for name, content in pages.items()}
+
+
+def _is_product_page_name(name):
+    """True for the gist files render_product_pages writes (see _product_page_name)."""
+    stem, ext = os.path.splitext(PRODUCT_GIST_FILE)
+    return re.fullmatch(rf"{re.escape(stem)}(?:_p\d+)?{re.escape(ext)}", name) is not None
+
+
+# Item fields the products page shows; their hash decides whether it changed.
+_PUBLISHED_ITEM_FIELDS = (
+    "pid", "name", "product_link", "image_url",
+    "original_price", "sale_price", "discount_percent", "sizes", "color_sizes",
+)
+
+
+def _products_content_hash(items):
+    """Hash the item data behind the products page (not its "Generated on" time)."""
+    rows = [[item.get(field) for field in _PUBLISHED_ITEM_FIELDS] for item in items]
+    rows.append(["page_size", PRODUCTS_PAGE_SIZE])
+    payload = json.dumps(rows, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _feed_record(item):
+    """One line of the NDJSON feed; keys are stable, new ones are only ever added."""
+    return {
+        "pid": item.get("pid"),
+        "name": item.get("name"),
+        "original_price": item.get("original_price"),
+        "sale_price": item.get("sale_price"),
+        "discount_percent": item.get("discount_percent"),
+        "colors": item.get("color_sizes") or [],
+        "sizes": item.get("sizes") or [],
+        "product_link": item.get("product_link"),
+        "image_url": item.get("image_url"),
+        "first_seen": item.get("first_seen"),
+    }
+
 
-def upload_to_gist(content):
+class _FeedWriter:
+    """Writes the NDJSON feed one item at a time, to ``path`` or to memory."""
+
+    def __init__(self, path=FEED_PATH):
+        self.path = path
+        self.count = 0
+        self._fp = None
+        if path:
+            try:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._fp = open(path, "w", encoding="utf-8")
+            except OSError as exc:
+                print(f"[feed] cannot write {path}, keeping the feed in memory: {exc}")
+                self.path = ""
+        if self._fp is None:
+            self._fp = io.StringIO()
+
+    def write(self, item):
+        self._fp.write(json.dumps(_feed_record(item), ensure_ascii=False, sort_keys=True))
+        self._fp.write("\n")
+        self._fp.flush()
+        self.count += 1
+
+    def getvalue(self):
+        if not self.path:
+            return self._fp.getvalue()
+        self.close()
+        with open(self.path, encoding="utf-8") as fp:
+            return fp.read()
+
+    def close(self):
+        if self.path:
+            self._fp.close()
+
+
+def upload_to_gist(files):
+    # Pages the list no longer fills are taken from the gist's own file list.
     gist_data = _upsert_gist(
         description=PRODUCT_GIST_DESCRIPTION,
-        files={PRODUCT_GIST_FILE: {"content": content}},
+        files=files,
         public=True,
+        prune=_is_product_page_name,
     )
     if gist_data:
         print("[gist] product gist upserted")
@@ -1439,51 +3459,244 @@ def upload_to_gist(content):
     return None
 
 
-def main():
-    previous_state = load_previous_state()
+def run_check(previous_state, stream_alerts=False):
+    """Run one full check against ``previous_state`` and publish the result.
+
+    Returns the state the next check should diff against: the new state when
+    it was (or would have been) saved, otherwise ``previous_state`` so that
+    undelivered additions are reported again. With ``stream_alerts``,
+    additions are sent in batches while round 2 is still running.
+    """
     previous_snapshot = previous_state.get("snapshot") or []
+    already_delivered = set(previous_state.get("telegram_delivered") or [])
+    delivered = set(already_delivered)
+
+    crawl_state = {
+        "listing_page_size": previous_state.get("listing_page_size"),
+        "product_cache": previous_state.get("product_cache") or {},
+    }
+    streamer = _StreamingAlerts(previous_snapshot, delivered) if stream_alerts else None
+    feed = _FeedWriter() if PUBLISH_FEED else None
+    now_iso = datetime.utcnow().isoformat(timespec="seconds") + "Z"
+    # Items already listed keep their first_seen; ones from before it was
+    # recorded were seen no later than the previous run.
+    first_seen = {
+        _item_key(rec): rec.get("first_seen") or previous_state.get("updated_at") or now_iso
+        for rec in previous_snapshot
+    }
 
-    items, html_content = fetch_discounted_products()
-    gist_url = upload_to_gist(html_content)
+    def on_item(item):
+        item["first_seen"] = first_seen.get(_item_key(item)) or now_iso
+        if feed is not None:
+            feed.write(item)
+        if streamer is not None:
+            streamer.add(item)
+
+    items, pages = fetch_discounted_products(crawl_state, on_item=on_item)
+    if streamer is not None:
+        streamer.flush()
+    content_hash = _products_content_hash(items)
+    if content_hash == previous_state.get("content_hash"):
+        # Same products as the saved state, hence no additions either: the
+        # page and feed stay as published. The crawl bookkeeping (refetched
+        # round-2 entries, page size) may still have moved on, so the state is
+        # saved when it did -- otherwise cron runs would refetch every product
+        # whose cache entry expired, on every run.
+        print(f"[gist] products unchanged ({content_hash[:12]}), skipping publish")
+        if feed is not None:
+            feed.close()
+        current_state = dict(
+            previous_state,
+            product_cache=crawl_state.get("product_cache") or {},
+            listing_page_size=crawl_state.get("listing_page_size"),
+        )
+        if (
+            current_state["product_cache"] != (previous_state.get("product_cache") or {})
+            or current_state["listing_page_size"] != previous_state.get("listing_page_size")
+        ):
+            save_current_state(current_state)
+        else:
+            print("[state] crawl state unchanged, not saved")
+        return current_state
+
+    product_files = _product_gist_files(pages)
+    if feed is not None:
+        feed_content = feed.getvalue()
+        if feed_content:
+            product_files[FEED_GIST_FILE] = {"content": feed_content}
+        else:
+            # Gists cannot hold empty files; drop the previous feed instead
+            # (_upsert_gist leaves this out if the gist has no feed file).
+            product_files[FEED_GIST_FILE] = None
+        print(f"[feed] {feed.count} item(s) in {FEED_GIST_FILE}")
+    # COMBINED_GIST: once the product gist's URL is known, the HTML waits and
+    # is published together with the state in a single PATCH.
+    gist_url = previous_state.get("gist_url") if COMBINED_GIST else None
+    pending_files = product_files if gist_url else None
+    if not gist_url:
+        gist_url = upload_to_gist(product_files)
 
     current_snapshot = _build_state_snapshot(items)
     diff = _compute_additions(previous_snapshot, current_snapshot)
     has_additions = _has_additions(diff)
     print(f"[state] has_additions={has_additions}")
 
+    current_state = {
+        "snapshot": current_snapshot,
+        "updated_at": datetime.utcnow().isoformat() + "Z",
+        "count": len(items),
+        "content_hash": content_hash,
+        "listing_page_size": crawl_state.get("listing_page_size"),
+        "product_cache": crawl_state.get("product_cache") or {},
+    }
+    if COMBINED_GIST and gist_url:
+        current_state["gist_url"] = gist_url
     if has_additions:
-        message = _format_telegram_update(diff, len(items), gist_url)
-        message_sent = send_telegram_message(message)
-        if message_sent:
-            save_current_state(
-                {
-                    "snapshot": current_snapshot,
-                    "updated_at": datetime.utcnow().isoformat() + "Z",
-                    "count": len(items),
-                }
-            )
+        messages = _format_telegram_update(
+            diff, len(items), gist_url, delivered, summary=streamer is not None
+        )
+        if not send_telegram_messages(messages, delivered):
+            if delivered != already_delivered:
+                # Keep the old snapshot but remember which entries got through,
+                # so the retry only sends the rest.
+                previous_state = dict(previous_state, telegram_delivered=sorted(delivered))
+                save_current_state(previous_state, product_files=pending_files)
+            elif pending_files is not None:
+                upload_to_gist(pending_files)
+            return previous_state
+        save_current_state(current_state, product_files=pending_files)
     else:
         print("[state] no additions, telegram not sent")
-        save_current_state(
-            {
-                "snapshot": current_snapshot,
-                "updated_at": datetime.utcnow().isoformat() + "Z",
-                "count": len(items),
-            }
-        )
+        save_current_state(current_state, product_files=pending_files)
+    return current_state
+
+
+def main(stream_alerts=False):
+    run_check(load_previous_state(), stream_alerts=stream_alerts)
 
 
-def run_offline(html_path, output_html=None):
+def watch(interval_minutes=10.0, jitter=0.2, stream_alerts=False):
+    """Check repeatedly in one process with a warm browser pool.
+
+    The previous state is loaded from the gist once at startup and then kept
+    in memory; each cycle starts ``interval_minutes`` (± ``jitter`` as a
+    fraction) after the previous one started, or right away if it overran.
+    """
+    previous_state = load_previous_state()
+    cycle = 0
+    while True:
+        cycle += 1
+        started = time.monotonic()
+        print(f"[watch] check #{cycle} at {datetime.now(JST).strftime('%Y-%m-%d %H:%M:%S JST')}")
+        try:
+            previous_state = run_check(previous_state, stream_alerts=stream_alerts)
+        except Exception as exc:
+            print(f"[watch] check #{cycle} failed: {exc}")
+        interval = interval_minutes * 60 * (1 + random.uniform(-jitter, jitter))
+        elapsed = time.monotonic() - started
+        pause = max(0.0, interval - elapsed)
+        print(f"[watch] check #{cycle} took {elapsed:.0f}s, next in {pause:.0f}s")
+        time.sleep(pause)
+
+
+def run_offline(html_path, output_html=None, stream=False, cache_path=PRODUCT_CACHE_PATH):
     """Parse a saved web-specials page (no browser / network) and report results.
 
     Lets us verify the listing parser against a real rendered page on one page,
     which is exactly what is needed to confirm the redesign selectors work.
+    With ``stream`` the file is parsed incrementally via iter_listing_items.
+    If a product cache exists at ``cache_path``, the color/size groups last
+    scraped for each item (same listing signature, any age) are attached.
     """
     with open(html_path, encoding="utf-8") as fp:
-        html = fp.read()
-
-    items = parse_listing_html(html, min_discount=0)
+        if stream:
+            items = list(iter_listing_items(fp, min_discount=0))
+        else:
+            raw_pids, items = scan_listing_page(fp.read(), min_discount=0)
+            print(f"[offline] {html_path}: {len(raw_pids)} product tiles")
     print(f"[offline] {html_path}: parsed {len(items)} discounted product tiles")
+    if cache_path and os.path.exists(cache_path):
+        cache = _open_product_cache(cache_path)
+        if cache is not None:
+            for it in items:
+                groups = cache.get(it["pid"], _listing_signature(it), check_ttl=False)
+                if groups:
+                    it["sizes"] = _format_size_groups(groups)
+            cache.close()
+    _report_items(items, output_html)
+    return items
+
+
+def run_offline_product(html_path):
+    """Parse a saved product detail page (no browser / network) and report groups."""
+    with open(html_path, encoding="utf-8") as fp:
+        groups = parse_product_html(fp.read())
+    complete = _product_groups_complete(groups)
+    print(
+        f"[offline] {html_path}: parsed {len(groups)} color groups"
+        f" ({'complete' if complete else 'live click path needed'})"
+    )
+    for group in groups:
+        print(
+            f"  - {group.get('color') or '(no color)'}: {' '.join(group.get('sizes') or [])}"
+            f" (sale={group.get('sale_price')}, list={group.get('list_price')})"
+        )
+    return groups
+
+
+def compare_browser_profiles(urls, ready_selector="[data-pid], [data-attr='color'], fieldset[data-attr='size']"):
+    """Load each URL with the full and the lean Chrome profile and print timings.
+
+    Load time is measured from navigation start until ``ready_selector`` is
+    present (what the scraper waits for); bytes are the Resource Timing lower
+    bound from _page_weight.
+    """
+    results = {}
+    for lean in (False, True):
+        label = "lean" if lean else "full"
+        drv = _new_driver(lean=lean)
+        try:
+            for url in urls:
+                started = time.monotonic()
+                drv.get(url)
+                try:
+                    WebDriverWait(drv, 30, poll_frequency=0.1).until(
+                        EC.presence_of_element_located((By.CSS_SELECTOR, ready_selector))
+                    )
+                except TimeoutException:
+                    print(f"[lean] {label}: timeout waiting for content on {url}")
+                elapsed = time.monotonic() - started
+                weight = _page_weight(drv)
+                results[(label, url)] = (elapsed, weight["bytes"], weight["requests"])
+                print(
+                    f"[lean] {label}: {url} {elapsed:.2f}s,"
+                    f" {weight['bytes'] / 1024:.0f} KiB, {weight['requests']} requests"
+                )
+        finally:
+            drv.quit()
+    for label in ("full", "lean"):
+        rows = [value for (profile, _), value in results.items() if profile == label]
+        if rows:
+            print(
+                f"[lean] {label} average: {sum(r[0] for r in rows) / len(rows):.2f}s,"
+                f" {sum(r[1] for r in rows) / len(rows) / 1024:.0f} KiB per page"
+            )
+    return results
+
+
+def run_listing_url(url_template, output_html=None):
+    """Run round 1 over HTTP only against ``url_template`` and report results.
+
+    Point it at a local stand-in server (e.g. ``python -m http.server``) serving
+    saved grid pages to exercise the HTTP crawler without touching the site.
+    """
+    items, page, page_size = crawl_listing_http(url_template)
+    print(f"[listing] {url_template}: parsed {len(items)} discounted product tiles")
+    _report_items(items, output_html)
+    return items
+
+
+def _report_items(items, output_html):
     for it in items:
         name = it["name"] or "(no name)"
         print(
@@ -1491,12 +3704,13 @@ def run_offline(html_path, output_html=None):
             f" (was ¥{it['original_price']:,}) -{it['discount_percent']}%"
         )
         print(f"      link: {it['product_link']}")
+        if it.get("sizes"):
+            print(f"      sizes (cached): {' | '.join(it['sizes'])}")
 
     if output_html:
         with open(output_html, "w", encoding="utf-8") as fp:
-            fp.write(render_products_html(items))
+            write_products_html(items, fp)
         print(f"[offline] wrote preview HTML to {output_html}")
-    return items
 
 
 if __name__ == "__main__":
@@ -1506,21 +3720,86 @@ if __name__ == "__main__":
         metavar="FILE",
         help="Parse a saved web-specials HTML file offline (no browser/network) and exit.",
     )
+    arg_parser.add_argument(
+        "--product-html",
+        metavar="FILE",
+        help="Parse a saved product detail page HTML offline and print its color/size groups.",
+    )
+    arg_parser.add_argument(
+        "--listing-url",
+        metavar="TEMPLATE",
+        help=(
+            "Crawl listing pages over HTTP only from a URL template containing"
+            " {start} and {sz} (e.g. a local stand-in server) and exit."
+        ),
+    )
+    arg_parser.add_argument(
+        "--compare-lean",
+        metavar="URL",
+        nargs="+",
+        help="Load the given pages with the full and the lean browser profile, print load time/bytes, and exit.",
+    )
+    arg_parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and check every --interval minutes with a warm browser.",
+    )
+    arg_parser.add_argument(
+        "--interval",
+        type=float,
+        default=10.0,
+        metavar="MINUTES",
+        help="With --watch, minutes between checks (default: 10).",
+    )
+    arg_parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.2,
+        metavar="FRACTION",
+        help="With --watch, random +/- fraction applied to each interval (default: 0.2).",
+    )
+    arg_parser.add_argument(
+        "--stream-alerts",
+        action="store_true",
+        default=STREAM_ALERTS,
+        help="Send Telegram alerts in batches while product pages are still being scraped.",
+    )
     arg_parser.add_argument(
         "--out",
         metavar="FILE",
-        help="With --html, also write a preview HTML of the parsed products.",
+        help="With --html or --listing-url, also write a preview HTML of the parsed products.",
+    )
+    arg_parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="With --html, parse the file incrementally (one product tile in memory at a time).",
+    )
+    arg_parser.add_argument(
+        "--cache",
+        metavar="FILE",
+        default=PRODUCT_CACHE_PATH,
+        help="With --html, product cache to read cached color/size groups from.",
     )
     args, _ = arg_parser.parse_known_args()
 
     if args.html:
-        run_offline(args.html, output_html=args.out)
+        run_offline(args.html, output_html=args.out, stream=args.stream, cache_path=args.cache)
+    elif args.product_html:
+        run_offline_product(args.product_html)
+    elif args.listing_url:
+        run_listing_url(args.listing_url, output_html=args.out)
+    elif args.compare_lean:
+        compare_browser_profiles(args.compare_lean)
     else:
         try:
-            main()
+            if args.watch:
+                watch(interval_minutes=args.interval, jitter=args.jitter, stream_alerts=args.stream_alerts)
+            else:
+                main(stream_alerts=args.stream_alerts)
+        except KeyboardInterrupt:
+            if not args.watch:
+                raise
+            print("[watch] interrupted, shutting down")
         finally:
-            if driver is not None:
-                try:
-                    driver.quit()
-                except Exception:
-                    pass
+            if driver_pool is not None:
+                driver_pool.quit_all()
@@ -0,0 +1,289 @@
+"""Benchmarks for the listing parser in autocheck.py.
+
+Builds synthetic web-specials pages from the tile variants in
+test_fixture.html (with unique data-pid values) wrapped in the kind of noise a
+real listing carries: inline scripts and JSON-LD, a mega-menu nav, filter
+refinements, promo slots inside the grid and a footer.
+
+The default suite runs every parser entry point -- ``parse_listing_html``,
+``scan_listing_page``, ``iter_listing_items`` and ``collect_tile_pids`` -- on
+pages of 48, 500, 5 000 and 50 000 tiles and reports tiles/s, time per page
+and the tracemalloc peak, optionally writing the results as JSON so runs can
+be compared (the 50 000-tile page takes a few minutes, mostly under
+tracemalloc):
+
+    python bench_parser.py [--sizes 48 500 5000 50000] [--json out.json]
+                           [--baseline previous.json]
+
+``--compare`` keeps the old quick check of the two-pass ``collect_tile_pids``
++ ``parse_listing_html`` against the single-pass ``scan_listing_page``:
+
+    python bench_parser.py --compare [--tiles 48] [--pages 100]
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import autocheck
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_fixture.html")
+DEFAULT_SIZES = (48, 500, 5000, 50000)
+# Repeat a measurement until it has run this long (or MAX_RUNS times).
+MIN_BENCH_SECONDS = 1.0
+MAX_RUNS = 50
+
+ENTRY_POINTS = {
+    "parse_listing_html": lambda html: autocheck.parse_listing_html(html),
+    "scan_listing_page": lambda html: autocheck.scan_listing_page(html),
+    "iter_listing_items": lambda html: list(autocheck.iter_listing_items(html)),
+    "collect_tile_pids": lambda html: autocheck.collect_tile_pids(html),
+}
+
+_HEAD_NOISE = """<head>
+<meta charset="UTF-8">
+<title>ウェブ・スペシャル | パタゴニア</title>
+<link rel="stylesheet" href="/on/demandware.static/Sites-patagonia-jp-Site/-/ja_JP/css/global.css">
+<style>.c-card{display:block}.product-grid{display:grid;grid-template-columns:repeat(4,1fr)}</style>
+<script>
+window.dataLayer = window.dataLayer || [];
+function gtag(){dataLayer.push(arguments);}
+gtag('js', new Date());
+var tpl = '<div class="product" data-pid="00000"><span>not a tile</span></div>';
+for (var i = 0; i < 10; i++) { if (i < 5 && tpl.length > 0) { dataLayer.push({i: i}); } }
+</script>
+<script type="application/ld+json">
+{"@context": "https://schema.org", "@type": "BreadcrumbList", "itemListElement": [
+ {"@type": "ListItem", "position": 1, "name": "ホーム", "item": "https://www.patagonia.jp/home/"},
+ {"@type": "ListItem", "position": 2, "name": "ウェブ・スペシャル", "item": "https://www.patagonia.jp/shop/web-specials/"}]}
+</script>
+</head>
+"""
+
+_NAV_CATEGORIES = ("メンズ", "ウィメンズ", "キッズ・ベビー", "パック・ギア", "ウェブ・スペシャル", "ストーリー")
+
+
+def _nav_noise():
+    parts = ['<header class="header"><nav class="main-nav" aria-label="メイン">\n<ul class="menu">\n']
+    for c, category in enumerate(_NAV_CATEGORIES):
+        parts.append(f'<li class="menu__item"><a href="/shop/cat-{c}/">{category}</a>\n<ul class="submenu">\n')
+        for s in range(12):
+            parts.append(
+                f'<li><a class="submenu__link" href="/shop/cat-{c}/sub-{s}/" data-gtm="nav">'
+                f"<span>サブカテゴリ {s}</span></a></li>\n"
+            )
+        parts.append("</ul></li>\n")
+    parts.append("</ul></nav></header>\n")
+    parts.append('<nav class="breadcrumb"><a href="/home/">ホーム</a> / <span>ウェブ・スペシャル</span></nav>\n')
+    parts.append('<aside class="refinements"><form action="/shop/web-specials/">\n')
+    for f in range(30):
+        parts.append(
+            f'<label class="refinement"><input type="checkbox" name="prefn{f}" value="v{f}">'
+            f"<span>フィルター {f}</span> <span class=\"count\">({f * 7 % 40})</span></label>\n"
+        )
+    parts.append("</form></aside>\n")
+    return "".join(parts)
+
+
+_PROMO_SLOT = """<div class="content-slot promo" data-slot="grid-promo">
+  <a href="/stories/worn-wear/"><img src="https://img.patagonia.jp/promo.jpg" alt="Worn Wear"></a>
+  <p>修理して長く着よう。<a href="/stories/">もっと見る</a></p>
+  <script>window.promoImpressions = (window.promoImpressions || 0) + 1;</script>
+</div>
+"""
+
+_FOOTER_NOISE = """<footer class="footer">
+<ul class="footer__links"><li><a href="/help/">ヘルプ</a></li><li><a href="/stores/">ストア</a></li>
+<li><a href="/company/">企業情報</a></li><li><a href="/privacy/">プライバシー</a></li></ul>
+<p class="copyright">&copy; Patagonia, Inc.</p>
+</footer>
+<script src="/on/demandware.static/Sites-patagonia-jp-Site/-/ja_JP/js/main.js" defer></script>
+<script>
+document.querySelectorAll('.c-card').forEach(function (el) { if (el.dataset.pid && el.offsetTop < 0) { el.remove(); } });
+</script>
+"""
+
+
+def _load_tiles(path):
+    with open(path, encoding="utf-8") as fp:
+        html = fp.read()
+    body = html.split('<div class="product-grid">', 1)[1].rsplit("</div>", 1)[0]
+    # Tiles in the fixture are separated by blank lines and a describing comment.
+    chunks = re.split(r"\n\s*\n", body)
+    return [chunk.strip() for chunk in chunks if "data-pid=" in chunk]
+
+
+def build_listing_page(tile_count, tiles=None, noise=False):
+    """Return a listing page with ``tile_count`` tiles, optionally wrapped in page noise."""
+    tiles = tiles or _load_tiles(FIXTURE)
+    parts = ['<!DOCTYPE html>\n<html lang="ja">']
+    if noise:
+        parts.append(_HEAD_NOISE)
+    parts.append("<body>\n")
+    if noise:
+        parts.append(_nav_noise())
+    parts.append('<div class="product-grid">\n')
+    for i in range(tile_count):
+        tile = tiles[i % len(tiles)]
+        parts.append(re.sub(r'data-pid="\d+"', f'data-pid="{100000 + i}"', tile, count=1))
+        parts.append("\n")
+        if noise and i % 24 == 23:
+            parts.append(_PROMO_SLOT)
+    parts.append("</div>\n")
+    if noise:
+        parts.append(_FOOTER_NOISE)
+    parts.append("</body></html>\n")
+    return "".join(parts)
+
+
+def _two_pass(html):
+    return autocheck.collect_tile_pids(html), autocheck.parse_listing_html(html)
+
+
+def _single_pass(html):
+    return autocheck.scan_listing_page(html)
+
+
+def _time(fn, html, pages):
+    start = time.perf_counter()
+    for _ in range(pages):
+        result = fn(html)
+    return time.perf_counter() - start, result
+
+
+def _measure(fn, html):
+    """Return ``(times, result)``: per-run wall times, repeated up to MIN_BENCH_SECONDS."""
+    times = []
+    result = None
+    while not times or (sum(times) < MIN_BENCH_SECONDS and len(times) < MAX_RUNS):
+        start = time.perf_counter()
+        result = fn(html)
+        times.append(time.perf_counter() - start)
+    return times, result
+
+
+def _peak_memory(fn, html):
+    tracemalloc.start()
+    try:
+        fn(html)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _check_consistent(results):
+    pids, items = results["scan_listing_page"]
+    if results["collect_tile_pids"] != pids:
+        raise SystemExit("collect_tile_pids differs from scan_listing_page")
+    if results["parse_listing_html"] != items or results["iter_listing_items"] != items:
+        raise SystemExit("parse_listing_html / iter_listing_items differ from scan_listing_page")
+
+
+def run_suite(sizes, entries, noise=True):
+    tiles = _load_tiles(FIXTURE)
+    results = []
+    for tile_count in sizes:
+        html = build_listing_page(tile_count, tiles, noise=noise)
+        print(f"{tile_count:,} tiles ({len(html):,} bytes/page)")
+        outputs = {}
+        for name in entries:
+            fn = ENTRY_POINTS[name]
+            times, outputs[name] = _measure(fn, html)
+            best = min(times)
+            peak = _peak_memory(fn, html)
+            results.append(
+                {
+                    "entry": name,
+                    "tiles": tile_count,
+                    "page_bytes": len(html),
+                    "runs": len(times),
+                    "time_per_page_s": best,
+                    "mean_time_s": sum(times) / len(times),
+                    "tiles_per_s": tile_count / best if best else None,
+                    "peak_memory_bytes": peak,
+                }
+            )
+            print(
+                f"  {name:<20} {best * 1000:10.1f} ms/page  {tile_count / best:12,.0f} tiles/s"
+                f"  peak {peak / 1024 / 1024:8.1f} MiB  ({len(times)} run(s))"
+            )
+        if set(ENTRY_POINTS) <= set(outputs):
+            _check_consistent(outputs)
+    return results
+
+
+def _report_baseline(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as fp:
+        baseline = json.load(fp)
+    previous = {(r["entry"], r["tiles"]): r for r in baseline.get("results", [])}
+    print(f"compared with {baseline_path} ({baseline.get('created_at', '?')}):")
+    for r in results:
+        old = previous.get((r["entry"], r["tiles"]))
+        if not old:
+            continue
+        time_change = (r["time_per_page_s"] / old["time_per_page_s"] - 1) * 100
+        memory_change = (r["peak_memory_bytes"] / old["peak_memory_bytes"] - 1) * 100
+        print(
+            f"  {r['entry']:<20} {r['tiles']:>7,} tiles  time {time_change:+6.1f}%"
+            f"  peak memory {memory_change:+6.1f}%"
+        )
+
+
+def compare_two_pass(tile_count, pages):
+    html = build_listing_page(tile_count)
+    two_time, two_result = _time(_two_pass, html, pages)
+    one_time, one_result = _time(_single_pass, html, pages)
+    if two_result != one_result:
+        raise SystemExit("scan_listing_page output differs from the two-pass result")
+
+    print(f"{pages} page(s) x {tile_count} tiles ({len(html):,} bytes/page)")
+    print(f"  collect_tile_pids + parse_listing_html: {two_time:.3f}s")
+    print(f"  scan_listing_page:                      {one_time:.3f}s")
+    print(f"  saving: {(1 - one_time / two_time) * 100:.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="tiles per page")
+    parser.add_argument(
+        "--entry",
+        choices=sorted(ENTRY_POINTS),
+        action="append",
+        help="entry point to run (repeatable; default: all)",
+    )
+    parser.add_argument("--no-noise", action="store_true", help="bare tile grid without scripts/nav")
+    parser.add_argument("--json", metavar="FILE", help="write the results to FILE as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="print changes against an earlier --json file")
+    parser.add_argument("--compare", action="store_true", help="two-pass vs single-pass quick check")
+    parser.add_argument("--tiles", type=int, default=48, help="with --compare: tiles per page (sz)")
+    parser.add_argument("--pages", type=int, default=100, help="with --compare: pages per run")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_two_pass(args.tiles, args.pages)
+        return
+
+    entries = args.entry or list(ENTRY_POINTS)
+    results = run_suite(args.sizes, entries, noise=not args.no_noise)
+    if args.json:
+        report = {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "noise": not args.no_noise,
+            "results": results,
+        }
+        with open(args.json, "w", encoding="utf-8") as fp:
+            json.dump(report, fp, indent=2)
+        print(f"wrote {args.json}")
+    if args.baseline:
+        _report_baseline(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()